@@ -0,0 +1,80 @@
+"""Compare the memory used by product dicts and ProductRecords in a multi-zip sweep.
+
+Simulates crawling the same products in several ZIP codes. Every crawl
+builds fresh strings, as values read from the browser are, and keeps its
+results for the whole sweep. The dict version copies each listing dict
+into a new item dict on the product page, as the crawler used to.
+
+    python benchmarks/record_memory.py --zipcodes 100 --products 1000
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from costco_crawler import ProductRecord
+
+IMAGE_PREFIX = "https://www.instacart.com/image-server/466x466/filters:fill(FFF,true):format(webp)/d2d8wwwkmhfcva.cloudfront.net/"
+
+def product_fields(i):
+    """Fresh strings for product i, like the ones returned by the driver."""
+    return {
+        "name": "".join(["Kirkland Signature Product ", str(i), ", 3 lb"]),
+        "url": "".join(["https://sameday.costco.com/store/costco/products/", str(2000000 + i), "-kirkland-signature-product-", str(i), "-3-lb"]),
+        "image_url": "".join([IMAGE_PREFIX, "466x466/d2lnr5mha7bycj.cloudfront.net/product-image/file/large_", format(i * 2654435761 % 2**32, "08x"), ".jpg"]),
+        "price": "".join(["$", str(i % 50), ".99"]),
+    }
+
+def sweep_dicts(zipcodes, products):
+    items = []
+    for _ in range(zipcodes):
+        listing = []
+        for i in range(products):
+            listing.append(dict(product_fields(i), page_position=i + 1))
+        for i, product_info in enumerate(listing):
+            items.append({
+                "name": product_info["name"],
+                "id": str(1000000 + i),
+                "url": product_info["url"],
+                "image_url": product_info["image_url"],
+                "price": product_info["price"],
+            })
+    return items
+
+def sweep_records(zipcodes, products):
+    items = []
+    for _ in range(zipcodes):
+        listing = []
+        for i in range(products):
+            listing.append(ProductRecord(page_position=i + 1, **product_fields(i)))
+        for i, record in enumerate(listing):
+            record["id"] = str(1000000 + i)
+            items.append(record)
+    return items
+
+def measure(sweep, zipcodes, products):
+    tracemalloc.start()
+    items = sweep(zipcodes, products)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+    return current, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory used by product dicts vs. ProductRecords")
+    parser.add_argument("--zipcodes", type=int, default=20, help="ZIP codes in the simulated sweep")
+    parser.add_argument("--products", type=int, default=1000, help="Products per ZIP code")
+    args = parser.parse_args()
+    
+    rows = args.zipcodes * args.products
+    print(f"{args.zipcodes} ZIP codes x {args.products} products = {rows} rows")
+    results = {}
+    for label, sweep in (("dicts", sweep_dicts), ("records", sweep_records)):
+        current, peak = measure(sweep, args.zipcodes, args.products)
+        results[label] = current
+        print(f"{label:>8}: {current / 2**20:8.1f} MB kept, {peak / 2**20:8.1f} MB peak, {current / rows:6.0f} bytes/row")
+    print(f"  saving: {1 - results['records'] / results['dicts']:.0%}")
+
+if __name__ == "__main__":
+    main()
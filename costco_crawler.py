@@ -3,21 +3,756 @@ import csv
 import time
 import platform
 import subprocess
+import sys
+import threading
+import abc
 import argparse
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import copy
 import datetime  # Add this import for date handling
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, ElementClickInterceptedException
-from webdriver_manager.chrome import ChromeDriverManager
-from webdriver_manager.core.os_manager import ChromeType
-
-def setup_driver(headless=True):
-    """Set up and return a configured Chrome webdriver."""
+import functools
+import glob
+import gzip
+import json
+import math
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import tempfile
+import urllib.parse
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.etree import ElementTree
+# Selenium and webdriver_manager are imported inside the functions that drive
+# the browser, so commands that don't need one (--help, export, ...) start fast
+
+logger = logging.getLogger("costco_crawler")
+
+# Category mappings (URL slugs and display names)
+CATEGORY_MAPPINGS = {
+    "produce": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-produce-50673",
+        "display_name": "produce"
+    },
+    "bakery": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-bakery-desserts-23722",
+        "display_name": "bakery"
+    },
+    "meat": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-meat-seafood-74327",
+        "display_name": "meat"
+    },
+    "deli": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-deli-37813",
+        "display_name": "deli"
+    },
+    "dairy": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-dairy-eggs-74913",
+        "display_name": "dairy"
+    },
+    "beverages": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-beverages-1068",
+        "display_name": "beverages"
+    },
+    "pantry": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-pantry-dry-goods-99939",
+        "display_name": "pantry"
+    },
+    "snacks": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-snacks-candy-nuts-80879",
+        "display_name": "snacks"
+    },
+    "frozen": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-frozen-foods-94815",
+        "display_name": "frozen"
+    },
+    "household": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-home-essentials-53494",
+        "display_name": "household"
+    },
+    "health": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-health-personal-care-6425",
+        "display_name": "health"
+    },
+    "baby": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-babies-19947",
+        "display_name": "baby"
+    },
+    "pet": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-pets-78792",
+        "display_name": "pet"
+    },
+    "alcohol": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-alcohol-77313",
+        "display_name": "alcohol"
+    },
+    "auto": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-auto-accessories-69500",
+        "display_name": "auto"
+    },
+    "cleaning": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-cleaning-laundry-products-75889",
+        "display_name": "cleaning"
+    },
+    "clothing": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-clothing-basics-85571",
+        "display_name": "clothing"
+    },
+    "electronics": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-electronics-93289",
+        "display_name": "electronics"
+    },
+    "garden": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-home-improvement-garden-87718",
+        "display_name": "garden"
+    },
+    "jewelry": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-jewelry-807",
+        "display_name": "jewelry"
+    },
+    "office": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-office-products-9771",
+        "display_name": "office"
+    },
+    "paper": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-paper-products-food-storage-18515",
+        "display_name": "paper"
+    },
+    "sports": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-sporting-goods-44049",
+        "display_name": "sports"
+    },
+    "toys": {
+        "url": "https://sameday.costco.com/store/costco/collections/n-toys-seasonal-5266",
+        "display_name": "toys"
+    },
+    "whats-new": {
+        "url": "https://sameday.costco.com/store/costco/collections/rc-whats-new",
+        "display_name": "whats-new"
+    },
+    "weekly-savings": {
+        "url": "https://sameday.costco.com/store/costco/collections/rc-weekly-savings",
+        "display_name": "weekly-savings"
+    },
+    "trending": {
+        "url": "https://sameday.costco.com/store/costco/collections/rc-trending",
+        "display_name": "trending"
+    },
+    "kirkland": {
+        "url": "https://sameday.costco.com/store/costco/collections/rc-kirkland-signature",
+        "display_name": "kirkland"
+    }
+}
+
+# Product pages live under this path; used to recognize product URLs
+PRODUCT_URL_MARKER = "/store/costco/products/"
+
+# Namespace of sitemap XML tags, e.g. {http://www.sitemaps.org/schemas/sitemap/0.9}loc
+SITEMAP_NAMESPACE = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+
+# Selector chains tried in order until one matches. The order below is the
+# default; with selector stats the chains are reordered by past success.
+
+# Target the structure: <a role="button" href="/store/costco/products/[ID]-[NAME]" class="...">
+PRODUCT_SELECTORS = [
+    "//a[@role='button' and contains(@href, '/store/costco/products/')]",
+    "//a[contains(@href, '/store/costco/products/')]",
+    "//div[contains(@class, 'e-19idom')]/ancestor::a",
+    "//div[contains(@class, 'e-bjn8wh')]/ancestor::a",
+    "//span[contains(@class, 'screen-reader-only') and contains(text(), 'Current price:')]/ancestor::a",
+    "//img[@data-testid='item-card-image']/ancestor::a"
+]
+
+# Look for the item ID in the format: <div class="e-16zy4wa">Item: 57554</div>
+# The last entry is a whole-document scan for any "Item ...: 12345" text
+ID_FALLBACK_SELECTOR = "//*[contains(text(), 'Item')]"
+ID_SELECTORS = [
+    "//div[contains(@class, 'e-16zy4wa')]",
+    "//div[contains(text(), 'Item:')]",
+    "//*[contains(text(), 'Item:')]",
+    ID_FALLBACK_SELECTOR
+]
+
+DETAIL_IMG_SELECTORS = [
+    "//img[contains(@alt, 'hero')]",  # Specific selector from the example
+    "//img[contains(@class, 'product-image')]",
+    "//img[contains(@alt, 'product')]"
+]
+
+# How much of a selector's score carries over to the next lookup. Lower values
+# demote selectors that stopped matching faster.
+SELECTOR_SCORE_DECAY = 0.8
+
+def write_json_atomic(filename, data, **dump_options):
+    """Write JSON to a temporary file next to filename, then move it into place.
+
+    Readers (and other processes writing the same file) never see a
+    half-written file.
+    """
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_file = tempfile.mkstemp(dir=directory, prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_options)
+        os.replace(temp_file, filename)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_file)
+        raise
+
+@contextlib.contextmanager
+def file_lock(filename):
+    """Hold an exclusive lock on <filename>.lock across processes (no lock where fcntl is missing)."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(f"{filename}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class SelectorStats(dict):
+    """Selector hit statistics (chain -> selector -> hits, misses, score).
+
+    A plain dict that also remembers the counts it was loaded with, so that
+    saving adds this run's hits and misses to the file instead of
+    overwriting what other processes saved in the meantime. The daemon's
+    request threads share one instance, so updates and snapshots hold lock.
+    """
+    
+    def __init__(self, stats=None):
+        super().__init__(stats or {})
+        self.loaded = copy.deepcopy(dict(self))
+        self.lock = threading.RLock()
+
+def load_selector_stats(filename):
+    """Load selector hit statistics from a JSON file (empty stats if missing)."""
+    if not os.path.exists(filename):
+        return SelectorStats()
+    try:
+        with open(filename, 'r', encoding='utf-8') as f:
+            return SelectorStats(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read selector stats from %s, starting fresh: %s", filename, e)
+        return SelectorStats()
+
+def merge_selector_stats(saved, loaded, current):
+    """Add the hits and misses gained since `loaded` in `current` to the `saved` stats.
+
+    Scores can't be added up, so the newest score of a selector this run
+    used replaces the saved one.
+    """
+    merged = copy.deepcopy(saved)
+    for chain, selectors in current.items():
+        for selector, entry in selectors.items():
+            base = loaded.get(chain, {}).get(selector, {"hits": 0, "misses": 0, "score": 0.0})
+            if entry == base:
+                continue  # Not used by this run
+            target = merged.setdefault(chain, {}).setdefault(selector, {"hits": 0, "misses": 0, "score": 0.0})
+            target["hits"] += entry["hits"] - base["hits"]
+            target["misses"] += entry["misses"] - base["misses"]
+            target["score"] = entry["score"]
+    return merged
+
+def save_selector_stats(selector_stats, filename):
+    """Add this run's selector hits and misses to the JSON stats file.
+
+    Workers, the scheduler and the daemon may share the file, so it is
+    re-read under a lock, merged and replaced atomically. A snapshot of the
+    in-memory stats is saved, so threads may keep recording meanwhile;
+    afterwards the in-memory stats are the file plus whatever they recorded.
+    """
+    lock = getattr(selector_stats, "lock", None) or contextlib.nullcontext()
+    with lock:
+        snapshot = copy.deepcopy(dict(selector_stats))
+    with file_lock(filename):
+        saved = dict(load_selector_stats(filename))
+        merged = merge_selector_stats(saved, getattr(selector_stats, "loaded", {}), snapshot)
+        write_json_atomic(filename, merged, indent=2, sort_keys=True)
+    if isinstance(selector_stats, SelectorStats):
+        with lock:
+            current = merge_selector_stats(merged, snapshot, selector_stats)
+            selector_stats.clear()
+            selector_stats.update(current)
+            selector_stats.loaded = merged
+    logger.info("Selector stats saved to %s", filename)
+
+def order_selectors(selector_stats, chain, selectors):
+    """Return the selectors of a chain ordered by their recent success.
+
+    Selectors without stats keep their default position relative to each other.
+    """
+    if not selector_stats or chain not in selector_stats:
+        return list(selectors)
+    with getattr(selector_stats, "lock", None) or contextlib.nullcontext():
+        scores = {s: entry["score"] for s, entry in selector_stats[chain].items()}
+    # sorted() is stable, so ties keep the default order
+    return sorted(selectors, key=lambda s: -scores.get(s, 0.0))
+
+def record_selector_result(selector_stats, chain, selector, hit):
+    """Record whether a selector matched, decaying its score on misses."""
+    if selector_stats is None:
+        return
+    with getattr(selector_stats, "lock", None) or contextlib.nullcontext():
+        entry = selector_stats.setdefault(chain, {}).setdefault(
+            selector, {"hits": 0, "misses": 0, "score": 0.0})
+        entry["score"] = entry["score"] * SELECTOR_SCORE_DECAY + (1.0 if hit else 0.0)
+        if hit:
+            entry["hits"] += 1
+        else:
+            entry["misses"] += 1
+
+def parse_item_id(text, loose=False):
+    """Extract the Costco item number from text like "Item: 57554".
+
+    With loose=True, also accept any "Item...: <digits>" text, as found by
+    the whole-document fallback scan.
+    """
+    if not loose:
+        if "Item:" in text:
+            return text.split("Item:")[1].strip() or None
+        return None
+    if "Item" in text and ":" in text:
+        parts = text.split(":")
+        if len(parts) > 1:
+            potential_id = parts[1].strip()
+            # Check if it's numeric
+            if potential_id.isdigit():
+                return potential_id
+    return None
+
+def get_category_info(category):
+    """Return the URL and display name of a built-in category.
+
+    Raises CategoryUrlError for unknown names; use a CategoryMap to also find
+    categories added to the site since.
+    """
+    if category.lower() not in CATEGORY_MAPPINGS:
+        raise CategoryUrlError(f"Unknown category '{category}' (known: {', '.join(sorted(CATEGORY_MAPPINGS))})")
+    return CATEGORY_MAPPINGS[category.lower()]
+
+def intern_text(value):
+    """Intern a string so every row repeating it (e.g. across ZIP codes) shares one copy."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+def split_url(url):
+    """Split a URL after its last "/" into two interned parts.
+
+    The first part (host, CDN path, image size...) is the same for most
+    products, so it is stored once instead of in every row.
+    """
+    if not isinstance(url, str):
+        return None, url
+    head, sep, tail = url.rpartition("/")
+    return sys.intern(head + sep), sys.intern(tail)
+
+class ProductRecord(collections.abc.Mapping):
+    """One product, from its listing card to its saved CSV row.
+
+    The listing page creates the record and the product page fills in the ID
+    and hero image on the same object, so a product is never copied between
+    the two phases. Fields live in slots instead of a per-row dict, strings
+    are interned and URLs share their common prefix.
+
+    Reads like the item dicts it replaces (item['name'], item.get(...)) and
+    iterates over the CSV columns; use to_dict() where a real dict is needed.
+    """
+    
+    __slots__ = ("name", "id", "price", "page_position", "_url_head", "_url_tail", "_image_head", "_image_tail")
+    FIELDS = ("name", "id", "url", "image_url", "price")
+    
+    def __init__(self, name=None, url=None, image_url=None, price=None, page_position=None, id=None):
+        self.name = intern_text(name)
+        self.id = intern_text(id)
+        self.price = intern_text(price)
+        self.page_position = page_position
+        self.url = url
+        self.image_url = image_url
+    
+    @classmethod
+    def from_mapping(cls, data):
+        """Return data as a ProductRecord (e.g. a product dict read back from JSON)."""
+        if isinstance(data, cls):
+            return data
+        return cls(**{key: data.get(key) for key in cls.FIELDS + ("page_position",)})
+    
+    @property
+    def url(self):
+        return self._url_head + self._url_tail if self._url_head is not None else self._url_tail
+    
+    @url.setter
+    def url(self, value):
+        self._url_head, self._url_tail = split_url(value)
+    
+    @property
+    def image_url(self):
+        return self._image_head + self._image_tail if self._image_head is not None else self._image_tail
+    
+    @image_url.setter
+    def image_url(self, value):
+        self._image_head, self._image_tail = split_url(value)
+    
+    def __getitem__(self, key):
+        if key not in self.FIELDS and key != "page_position":
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS and key != "page_position":
+            raise KeyError(key)
+        setattr(self, key, intern_text(value))
+    
+    def __iter__(self):
+        return iter(self.FIELDS)
+    
+    def __len__(self):
+        return len(self.FIELDS)
+    
+    def __repr__(self):
+        return f"ProductRecord({self.to_dict()!r})"
+    
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
+
+def record_to_json(value):
+    """json.dumps default= hook that writes ProductRecords as plain objects."""
+    if isinstance(value, ProductRecord):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class JsonLogFormatter(logging.Formatter):
+    """Formats log records as one JSON object per line."""
+    
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key in ("sample", "suppressed"):
+            if hasattr(record, key):
+                entry[key] = getattr(record, key)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+class LogSampler(logging.Filter):
+    """Thins out repetitive log messages from the per-product loops.
+    
+    Records logged with extra={"sample": key} are counted per key: the first
+    `burst` always pass, then only every `every`-th one does. The number of
+    records dropped since the last one that passed is attached to it as
+    `suppressed`. Warnings and errors are never dropped.
+    """
+    
+    def __init__(self, every=10, burst=20):
+        super().__init__()
+        self.every = max(1, every)
+        self.burst = burst
+        self.counts = {}
+        self.dropped = {}
+        self.lock = threading.Lock()
+    
+    def filter(self, record):
+        key = getattr(record, "sample", None)
+        if key is None:
+            return True
+        with self.lock:
+            count = self.counts.get(key, 0) + 1
+            self.counts[key] = count
+            keep = (record.levelno >= logging.WARNING or count <= self.burst
+                    or (count - self.burst) % self.every == 0)
+            if not keep:
+                self.dropped[key] = self.dropped.get(key, 0) + 1
+                return False
+            suppressed = self.dropped.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class TextLogFormatter(logging.Formatter):
+    """Plain-text output that also says how many sampled lines were dropped."""
+    
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" (+{suppressed} similar suppressed)"
+        return text
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """Queues records with their message merged but the traceback kept apart.
+
+    The standard handler folds the traceback into the message, which would
+    leave the JSON output's "exception" field empty. The message is merged
+    here, after the sampler, so dropped records are never formatted.
+    """
+    
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks hold frames, so only their text goes on the queue
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def setup_logging(level="INFO", json_format=False, log_file=None, sample_every=10):
+    """Send the crawler's log through a queue so the crawl never waits on I/O.
+    
+    Records are sampled and queued in the calling thread; a background
+    listener formats them and writes them to stdout or `log_file`. Returns the
+    listener, which must be stopped to flush the queue before exiting.
+    """
+    if log_file:
+        handler = logging.FileHandler(log_file, encoding='utf-8')
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonLogFormatter() if json_format else TextLogFormatter("%(message)s"))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = LogQueueHandler(log_queue)
+    if sample_every > 1:
+        queue_handler.addFilter(LogSampler(every=sample_every))
+    
+    logger.handlers[:] = [queue_handler]
+    logger.setLevel(level.upper())
+    logger.propagate = False
+    
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+class CommandTracer:
+    """Collects timed WebDriver commands and crawl steps as Chrome trace events.
+
+    The saved file opens in chrome://tracing or https://ui.perfetto.dev.
+    """
+    
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self.start = time.perf_counter()
+    
+    @contextlib.contextmanager
+    def span(self, name, category, **args):
+        """Record the enclosed block as one complete ("X") event."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((start - self.start) * 1e6, 1),
+                "dur": round((end - start) * 1e6, 1),
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": args
+            })
+    
+    def save(self, filename):
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        logger.info("Saved %s trace events to %s", len(self.events), filename)
+
+class TraceProxy:
+    """Wraps a WebDriver or WebElement and records every command sent through it.
+
+    Method calls and property reads (page_source, text, ...) are timed;
+    elements returned by the wrapped object are wrapped in turn.
+    """
+    
+    def __init__(self, target, tracer, kind="driver"):
+        self._target = target
+        self._kind = kind
+        self.tracer = tracer
+    
+    def __getattr__(self, name):
+        target = self._target
+        if name.startswith("_"):
+            return getattr(target, name)
+        
+        # Properties like page_source or text are WebDriver commands too
+        if isinstance(getattr(type(target), name, None), property):
+            with self.tracer.span(f"{self._kind}.{name}", "webdriver", caller=sys._getframe(1).f_code.co_name):
+                return self._wrap(getattr(target, name))
+        
+        attribute = getattr(target, name)
+        if not callable(attribute):
+            return attribute
+        
+        def traced_command(*args, **kwargs):
+            detail = " ".join(str(arg)[:120] for arg in args if isinstance(arg, (str, int, float)))
+            with self.tracer.span(f"{self._kind}.{name}", "webdriver",
+                                  caller=sys._getframe(1).f_code.co_name, detail=detail):
+                return self._wrap(attribute(*args, **kwargs))
+        return traced_command
+    
+    def _wrap(self, value):
+        if isinstance(value, list):
+            return [self._wrap(item) for item in value]
+        # Duck-type WebElements so selenium doesn't have to be imported here
+        if hasattr(value, "get_attribute") and hasattr(value, "find_element") and not isinstance(value, TraceProxy):
+            return TraceProxy(value, self.tracer, kind="element")
+        return value
+
+def pause(driver, seconds):
+    """Wait for the page; the wait shows up in the trace when the driver is traced."""
+    tracer = getattr(driver, "tracer", None)
+    if tracer is None:
+        time.sleep(seconds)
+        return
+    with tracer.span("sleep", "wait", seconds=seconds, caller=sys._getframe(1).f_code.co_name):
+        time.sleep(seconds)
+
+def traced_step(function):
+    """Record a crawl step taking the driver as first argument as one span in the trace."""
+    @functools.wraps(function)
+    def wrapper(driver, *args, **kwargs):
+        tracer = getattr(driver, "tracer", None)
+        if tracer is None:
+            return function(driver, *args, **kwargs)
+        with tracer.span(function.__name__, "step"):
+            return function(driver, *args, **kwargs)
+    return wrapper
+
+def copy_tree(source, destination):
+    """Copy a directory, sharing blocks copy-on-write where the file system supports it."""
+    system = platform.system()
+    command = {"Linux": ["cp", "-a", "--reflink=auto"], "Darwin": ["cp", "-cR"]}.get(system)
+    # cp needs the parent of the destination to exist
+    os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+    if command:
+        try:
+            subprocess.run(command + [source, destination], check=True, capture_output=True)
+            return
+        except (subprocess.SubprocessError, FileNotFoundError):
+            shutil.rmtree(destination, ignore_errors=True)
+    shutil.copytree(source, destination)
+
+class BrowserCache:
+    """Warm HTTP cache shared by the browsers of all runs and workers.
+
+    Chrome can't share a profile between running browsers, so every browser
+    gets its own profile, seeded with a copy of the warm template's cache
+    folders (copy-on-write where the file system allows). When a browser
+    quits, its cache becomes the new template if the current one is missing
+    or older than refresh_hours. Only cache folders are copied, never
+    cookies or site storage, so delivery locations don't leak between
+    browsers. Chrome keeps the HTTP cache under max_mb.
+    """
+    
+    CACHE_FOLDERS = (os.path.join("Default", "Cache"), os.path.join("Default", "Code Cache"))
+    
+    def __init__(self, directory="browser_cache", max_mb=300, refresh_hours=24):
+        self.directory = directory
+        self.max_mb = max_mb
+        self.refresh_hours = refresh_hours
+        self.profiles_dir = os.path.join(directory, "profiles")
+        self.templates_dir = os.path.join(directory, "templates")
+        self.pointer = os.path.join(directory, "current")
+        os.makedirs(self.profiles_dir, exist_ok=True)
+        os.makedirs(self.templates_dir, exist_ok=True)
+        # Profiles left behind by browsers that crashed a day or more ago
+        self._remove_older_than(self.profiles_dir, 24 * 3600)
+    
+    def _remove_older_than(self, directory, seconds, keep=()):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            try:
+                if name not in keep and time.time() - os.path.getmtime(path) > seconds:
+                    shutil.rmtree(path, ignore_errors=True)
+            except OSError:
+                pass
+    
+    def current_template(self):
+        """Return the path of the warm template, or None if there is none yet."""
+        try:
+            with open(self.pointer, 'r', encoding='utf-8') as f:
+                path = os.path.join(self.templates_dir, f.read().strip())
+        except OSError:
+            return None
+        return path if os.path.isdir(path) else None
+    
+    def new_profile(self):
+        """Create a browser profile directory seeded with the warm cache."""
+        profile = os.path.join(self.profiles_dir, uuid.uuid4().hex)
+        os.makedirs(os.path.join(profile, "Default"))
+        template = self.current_template()
+        if template is not None:
+            try:
+                for folder in self.CACHE_FOLDERS:
+                    if os.path.isdir(os.path.join(template, folder)):
+                        copy_tree(os.path.join(template, folder), os.path.join(profile, folder))
+            except (OSError, shutil.Error) as e:
+                # A newer template may have replaced this one mid-copy
+                logger.warning("Could not seed browser cache, starting cold: %s", e)
+                shutil.rmtree(profile, ignore_errors=True)
+                os.makedirs(os.path.join(profile, "Default"))
+        return profile
+    
+    def chrome_arguments(self, profile):
+        return [f"--user-data-dir={os.path.abspath(profile)}", f"--disk-cache-size={self.max_mb * 2**20}"]
+    
+    def release(self, profile):
+        """Remove a quit browser's profile, first promoting its cache to template if due."""
+        try:
+            template = self.current_template()
+            stale = template is None or (time.time() - os.path.getmtime(self.pointer)) / 3600 >= self.refresh_hours
+            if stale and os.path.isdir(os.path.join(profile, self.CACHE_FOLDERS[0])):
+                name = f"{int(time.time())}-{uuid.uuid4().hex[:8]}"
+                for folder in self.CACHE_FOLDERS:
+                    if os.path.isdir(os.path.join(profile, folder)):
+                        copy_tree(os.path.join(profile, folder), os.path.join(self.templates_dir, name, folder))
+                # Switch templates atomically, so other workers never seed from a half-written one
+                temp_pointer = f"{self.pointer}.{uuid.uuid4().hex}"
+                with open(temp_pointer, 'w', encoding='utf-8') as f:
+                    f.write(name)
+                os.replace(temp_pointer, self.pointer)
+                logger.info("Browser cache template refreshed (%s)", name)
+                # Templates are removed by the time they were replaced, not created: give workers
+                # still copying the old one a few minutes
+                if template is not None:
+                    os.utime(template)
+                current = self.current_template()
+                self._remove_older_than(self.templates_dir, 600,
+                                        keep={name, os.path.basename(current) if current else name})
+        except (OSError, shutil.Error) as e:
+            logger.warning("Could not refresh browser cache template: %s", e)
+        finally:
+            shutil.rmtree(profile, ignore_errors=True)
+
+def setup_driver(headless=True, browser_cache=None):
+    """Set up and return a configured Chrome webdriver.
+
+    With a BrowserCache, the browser starts from the shared warm cache and
+    hands its own cache back when it quits.
+    """
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+    from selenium.webdriver.chrome.service import Service
+    from webdriver_manager.chrome import ChromeDriverManager
+    
     chrome_options = Options()
     if headless:
         chrome_options.add_argument("--headless")  # Run in headless mode
@@ -26,38 +761,43 @@ def setup_driver(headless=True):
     if headless:
         chrome_options.add_argument("--disable-gpu")
     chrome_options.add_argument("--window-size=1920,1080")
+    profile = None
+    if browser_cache is not None:
+        profile = browser_cache.new_profile()
+        for argument in browser_cache.chrome_arguments(profile):
+            chrome_options.add_argument(argument)
     
     # Special handling for Mac
     is_mac = platform.system() == 'Darwin'
     is_arm = 'arm' in platform.machine().lower()
     
     if is_mac and is_arm:
-        print("Detected macOS on ARM architecture (Apple Silicon)")
+        logger.info("Detected macOS on ARM architecture (Apple Silicon)")
         try:
             # Try to use homebrew installed chromedriver if available
             # Check if chromedriver is installed via homebrew
             try:
                 subprocess.run(["brew", "--version"], check=True, capture_output=True)
-                print("Homebrew is installed, checking for chromedriver...")
+                logger.info("Homebrew is installed, checking for chromedriver...")
                 result = subprocess.run(["brew", "list", "chromedriver"], check=False, capture_output=True)
                 
                 if result.returncode == 0:
-                    print("Using homebrew installed chromedriver")
+                    logger.info("Using homebrew installed chromedriver")
                     chrome_path = subprocess.run(["which", "chromedriver"], check=True, 
                                            capture_output=True, text=True).stdout.strip()
                     service = Service(executable_path=chrome_path)
                 else:
-                    print("Chromedriver not installed via homebrew. Installing it now...")
+                    logger.info("Chromedriver not installed via homebrew. Installing it now...")
                     subprocess.run(["brew", "install", "chromedriver"], check=True)
                     chrome_path = subprocess.run(["which", "chromedriver"], check=True, 
                                            capture_output=True, text=True).stdout.strip()
                     service = Service(executable_path=chrome_path)
             except (subprocess.SubprocessError, FileNotFoundError):
-                print("Homebrew not available, falling back to webdriver_manager...")
+                logger.info("Homebrew not available, falling back to webdriver_manager...")
                 service = Service(ChromeDriverManager().install())
         except Exception as e:
-            print(f"Error setting up chromedriver: {e}")
-            print("Falling back to default webdriver_manager...")
+            logger.warning("Error setting up chromedriver: %s", e)
+            logger.warning("Falling back to default webdriver_manager...")
             service = Service(ChromeDriverManager().install())
     else:
         # For non-Mac or Intel Mac
@@ -65,69 +805,89 @@ def setup_driver(headless=True):
     
     try:
         driver = webdriver.Chrome(service=service, options=chrome_options)
-        return driver
     except Exception as e:
-        print(f"Error initializing Chrome driver: {e}")
-        print("Try installing Chrome browser if not already installed")
+        if profile is not None:
+            shutil.rmtree(profile, ignore_errors=True)
+        logger.error("Error initializing Chrome driver: %s", e)
+        logger.error("Try installing Chrome browser if not already installed")
         raise
+    
+    if profile is not None:
+        # The cache can only be handed back once Chrome has exited and flushed it
+        chrome_quit = driver.quit
+        def quit_and_release_cache():
+            try:
+                chrome_quit()
+            finally:
+                browser_cache.release(profile)
+        driver.quit = quit_and_release_cache
+    return driver
 
+@traced_step
 def set_location(driver, zipcode="94107"):
     """Set the delivery location using the provided zipcode."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+    
     driver.get("https://sameday.costco.com")
-    print("Navigated to Costco Sameday website")
+    logger.info("Navigated to Costco Sameday website")
     
     try:
         # Wait for any zip code input to be available
-        print("Waiting for zip code input field...")
+        logger.info("Waiting for zip code input field...")
         wait = WebDriverWait(driver, 15)
         
         # Take a screenshot to debug
         driver.save_screenshot("initial_page.png")
-        print(f"Saved screenshot to initial_page.png")
+        logger.info("Saved screenshot to initial_page.png")
         
         # Try to find the zip code input field (only using the selector that worked previously)
-        print("Looking for ZIP code input field...")
+        logger.info("Looking for ZIP code input field...")
         location_input = wait.until(
             EC.presence_of_element_located((By.XPATH, "//input[@type='text' and contains(@placeholder, 'ZIP')]"))
         )
-        print("Found ZIP code input field")
+        logger.info("Found ZIP code input field")
             
         # Enter the zipcode
-        print(f"Entering zipcode: {zipcode}")
+        logger.info("Entering zipcode: %s", zipcode)
         location_input.clear()
         location_input.send_keys(zipcode)
         
         # Submit using the form submit button (method 5 that worked before)
-        print("Submitting zipcode using form button")
+        logger.info("Submitting zipcode using form button")
         submit_button = driver.find_element(By.XPATH, "//form//button[@type='submit']")
         submit_button.click()
-        print("Submission method succeeded")
+        logger.info("Submission method succeeded")
         
         # Wait for page to react
-        time.sleep(3)
+        pause(driver, 3)
         
         # Take a screenshot after submitting zip
         driver.save_screenshot("after_zip_submission.png")
-        print(f"Saved screenshot to after_zip_submission.png")
+        logger.info("Saved screenshot to after_zip_submission.png")
         
         # Check if we successfully navigated to a shopping page
         if "collections" in driver.current_url or "store" in driver.current_url:
-            print(f"Successfully set location to zipcode: {zipcode}")
-            print(f"Current URL: {driver.current_url}")
+            logger.info("Successfully set location to zipcode: %s", zipcode)
+            logger.info("Current URL: %s", driver.current_url)
             return True
         else:
-            print(f"Failed to navigate to shopping page. Current URL: {driver.current_url}")
+            logger.warning("Failed to navigate to shopping page. Current URL: %s", driver.current_url)
             return False
         
     except Exception as e:
-        print(f"Error setting location: {e}")
+        logger.error("Error setting location: %s", e)
         # Take error screenshot
         driver.save_screenshot("location_error.png")
-        print(f"Saved error screenshot to location_error.png")
+        logger.error("Saved error screenshot to location_error.png")
         return False
 
+@traced_step
 def handle_popups(driver):
     """Handle any popup dialogs, cookie notices, or modal windows that might appear."""
+    from selenium.webdriver.common.by import By
+    
     try:
         # List of possible selectors for close/accept buttons on popups
         popup_selectors = [
@@ -159,22 +919,55 @@ def handle_popups(driver):
             try:
                 popup_elements = driver.find_elements(By.XPATH, selector)
                 if popup_elements:
-                    print(f"Found popup element with selector: {selector}")
+                    logger.info("Found popup element with selector: %s", selector, extra={"sample": "popup_found"})
                     for element in popup_elements:
                         if element.is_displayed():
                             element.click()
-                            print(f"Clicked on popup element with selector: {selector}")
-                            time.sleep(1)  # Small delay to let the popup close
+                            logger.info("Clicked on popup element with selector: %s", selector, extra={"sample": "popup_clicked"})
+                            pause(driver, 1)  # Small delay to let the popup close
             except Exception as e:
-                print(f"Error handling popup with selector {selector}: {e}")
+                logger.debug("Error handling popup with selector %s: %s", selector, e, extra={"sample": "popup_error"})
         
         return True
     except Exception as e:
-        print(f"Error in handle_popups: {e}")
+        logger.error("Error in handle_popups: %s", e)
         return False
 
+def start_session(headless=True, zipcode="94107", tracer=None, browser_cache=None):
+    """Start a browser and set the delivery location.
+
+    Returns the ready driver, or None if the location could not be set.
+    With a CommandTracer, the driver is wrapped so every command is traced.
+    With a BrowserCache, the browser starts from the shared warm cache.
+    """
+    driver = setup_driver(headless=headless, browser_cache=browser_cache)
+    if tracer is not None:
+        driver = TraceProxy(driver, tracer)
+    try:
+        # Take screenshot of the initial state
+        driver.get("https://sameday.costco.com")
+        pause(driver, 3)
+        driver.save_screenshot("before_location.png")
+        logger.info("Took screenshot of initial state")
+        
+        # Handle any initial popups before setting location
+        handle_popups(driver)
+        
+        if not set_location(driver, zipcode=zipcode):
+            driver.quit()
+            return None
+        
+        # Handle any popups after setting location
+        handle_popups(driver)
+        return driver
+    except Exception:
+        driver.quit()
+        raise
+
 def scrape_produce_items(driver, max_items=None):
     """Scrape all produce items from the page."""
+    from selenium.webdriver.common.by import By
+    
     produce_url = "https://sameday.costco.com/store/costco/collections/n-produce-50673"
     driver.get(produce_url)
     print(f"Navigated to produce URL: {produce_url}")
@@ -569,583 +1362,3114 @@ def scrape_produce_items(driver, max_items=None):
     print(f"Successfully processed {len(deduplicated_items)} unique products")
     return deduplicated_items
 
-def scrape_items(driver, category="produce", max_items=None):
-    """Scrape all items from the specified category page."""
-    # Define category mappings (URL slugs and display names)
-    category_mappings = {
-        "produce": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-produce-50673",
-            "display_name": "produce"
-        },
-        "bakery": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-bakery-desserts-23722",
-            "display_name": "bakery"
-        },
-        "meat": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-meat-seafood-74327",
-            "display_name": "meat"
-        },
-        "deli": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-deli-37813",
-            "display_name": "deli"
-        },
-        "dairy": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-dairy-eggs-74913",
-            "display_name": "dairy"
-        },
-        "beverages": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-beverages-1068",
-            "display_name": "beverages"
-        },
-        "pantry": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-pantry-dry-goods-99939",
-            "display_name": "pantry"
-        },
-        "snacks": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-snacks-candy-nuts-80879",
-            "display_name": "snacks"
-        },
-        "frozen": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-frozen-foods-94815",
-            "display_name": "frozen"
-        },
-        "household": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-home-essentials-53494",
-            "display_name": "household"
-        },
-        "health": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-health-personal-care-6425",
-            "display_name": "health"
-        },
-        "baby": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-babies-19947",
-            "display_name": "baby"
-        },
-        "pet": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-pets-78792",
-            "display_name": "pet"
-        },
-        "alcohol": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-alcohol-77313",
-            "display_name": "alcohol"
-        },
-        "auto": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-auto-accessories-69500",
-            "display_name": "auto"
-        },
-        "cleaning": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-cleaning-laundry-products-75889",
-            "display_name": "cleaning"
-        },
-        "clothing": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-clothing-basics-85571",
-            "display_name": "clothing"
-        },
-        "electronics": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-electronics-93289",
-            "display_name": "electronics"
-        },
-        "garden": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-home-improvement-garden-87718",
-            "display_name": "garden"
-        },
-        "jewelry": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-jewelry-807",
-            "display_name": "jewelry"
-        },
-        "office": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-office-products-9771",
-            "display_name": "office"
-        },
-        "paper": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-paper-products-food-storage-18515",
-            "display_name": "paper"
-        },
-        "sports": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-sporting-goods-44049",
-            "display_name": "sports"
-        },
-        "toys": {
-            "url": "https://sameday.costco.com/store/costco/collections/n-toys-seasonal-5266",
-            "display_name": "toys"
-        },
-        "whats-new": {
-            "url": "https://sameday.costco.com/store/costco/collections/rc-whats-new",
-            "display_name": "whats-new"
-        },
-        "weekly-savings": {
-            "url": "https://sameday.costco.com/store/costco/collections/rc-weekly-savings",
-            "display_name": "weekly-savings"
-        },
-        "trending": {
-            "url": "https://sameday.costco.com/store/costco/collections/rc-trending",
-            "display_name": "trending"
-        },
-        "kirkland": {
-            "url": "https://sameday.costco.com/store/costco/collections/rc-kirkland-signature",
-            "display_name": "kirkland"
-        }
+def browser_rss_mb(driver):
+    """Return the combined resident memory (MB) of chromedriver and its browser processes.
+
+    Returns None if the process tree can't be inspected on this platform.
+    """
+    try:
+        root_pid = driver.service.process.pid
+    except AttributeError:
+        return None
+    try:
+        output = subprocess.run(["ps", "-A", "-o", "pid=,ppid=,rss="], check=True,
+                                capture_output=True, text=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+    
+    children = {}
+    rss_kb = {}
+    for line in output.splitlines():
+        parts = line.split()
+        if len(parts) != 3 or not all(part.isdigit() for part in parts):
+            continue
+        pid, ppid, rss = (int(part) for part in parts)
+        children.setdefault(ppid, []).append(pid)
+        rss_kb[pid] = rss
+    
+    # Sum the RSS of the whole process tree below chromedriver
+    total_kb = 0
+    stack = [root_pid]
+    while stack:
+        pid = stack.pop()
+        total_kb += rss_kb.get(pid, 0)
+        stack.extend(children.get(pid, []))
+    return total_kb / 1024
+
+class DriverWatchdog:
+    """Recycles the browser during long crawls before it grows too large.
+
+    Call checkpoint() before each page; it returns the driver to use, which is
+    a fresh one from driver_factory (with the location already set) once the
+    page count or the browser memory passes its threshold. A threshold of 0
+    disables that check. With a deadline, the browser is no longer recycled
+    once starting a new one would run past it. Recycle events are kept for
+    the run summary.
+    """
+    
+    def __init__(self, driver, driver_factory, max_pages=500, max_rss_mb=2048, check_every=10, deadline=None):
+        self.driver = driver
+        self.driver_factory = driver_factory
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.check_every = check_every
+        self.deadline = deadline
+        self.startup_seconds = BROWSER_STARTUP_SECONDS
+        self.pages = 0
+        self.events = []
+    
+    def checkpoint(self):
+        """Count a page and return the driver to load it with."""
+        self.pages += 1
+        reason = None
+        rss_mb = None
+        if self.max_pages and self.pages > self.max_pages:
+            reason = f"page count over {self.max_pages}"
+        elif self.max_rss_mb and self.pages % self.check_every == 0:
+            # Measuring memory forks ps, so only do it every few pages
+            rss_mb = browser_rss_mb(self.driver)
+            if rss_mb is not None and rss_mb > self.max_rss_mb:
+                reason = f"memory {rss_mb:.0f} MB over {self.max_rss_mb} MB"
+        
+        if reason and self.deadline is not None and time.time() + self.startup_seconds > self.deadline:
+            logger.info("Not recycling the browser (%s): no time left to start a new one", reason,
+                        extra={"sample": "recycle_skipped"})
+        elif reason:
+            self.recycle(reason, rss_mb)
+        return self.driver
+    
+    def recycle(self, reason, rss_mb=None):
+        """Replace the browser with a fresh, located one."""
+        logger.info("Recycling browser after %s pages (%s)", self.pages - 1, reason)
+        started = time.time()
+        try:
+            new_driver = self.driver_factory()
+        except Exception as e:
+            logger.warning("Could not start a new browser, keeping the current one: %s", e)
+            new_driver = None
+        if new_driver is not None:
+            self.startup_seconds = time.time() - started
+        
+        self.events.append({
+            "time": datetime.datetime.now().isoformat(timespec='seconds'),
+            "pages": self.pages - 1,
+            "rss_mb": round(rss_mb) if rss_mb is not None else None,
+            "reason": reason,
+            "succeeded": new_driver is not None
+        })
+        self.pages = 1
+        
+        if new_driver is not None:
+            try:
+                self.driver.quit()
+            except Exception as e:
+                logger.warning("Error closing the old browser: %s", e)
+            self.driver = new_driver
+
+def url_item_id(url, position):
+    """Build a fallback item ID from the product URL (e.g. url-12345)."""
+    url_parts = url.split('/')
+    if len(url_parts) > 0:
+        last_part = url_parts[-1]
+        # The ID-like part is before the first dash
+        url_id = last_part.split('-')[0] if '-' in last_part else last_part
+        return f"url-{url_id}"
+    return f"unknown-{position}"
+
+# Finds the item ID and hero image on a product page in one WebDriver call.
+# Arguments: ordered ID selectors, the loose fallback selector, ordered image
+# selectors. Mirrors parse_item_id() and returns the index of the selector
+# that matched in each chain (-1 if none did), plus the page's name and price.
+DETAIL_EXTRACTION_SCRIPT = """
+const idSelectors = arguments[0], idFallback = arguments[1], imgSelectors = arguments[2];
+function findAll(xpath) {
+    const snapshot = document.evaluate(xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    const nodes = [];
+    for (let i = 0; i < snapshot.snapshotLength; i++) nodes.push(snapshot.snapshotItem(i));
+    return nodes;
+}
+function parseId(text, loose) {
+    if (!loose) {
+        if (text.includes("Item:")) return text.split("Item:")[1].trim() || null;
+        return null;
+    }
+    if (text.includes("Item") && text.includes(":")) {
+        const candidate = text.split(":")[1].trim();
+        if (/^[0-9]+$/.test(candidate)) return candidate;
+    }
+    return null;
+}
+const result = {item_id: null, id_selector_index: -1, hero_src: null, hero_srcset: null, img_selector_index: -1,
+                name: null, price: null};
+for (let i = 0; i < idSelectors.length && !result.item_id; i++) {
+    for (const el of findAll(idSelectors[i])) {
+        const id = parseId((el.innerText || el.textContent || "").trim(), idSelectors[i] === idFallback);
+        if (id) { result.item_id = id; result.id_selector_index = i; break; }
+    }
+}
+for (let i = 0; i < imgSelectors.length; i++) {
+    const images = findAll(imgSelectors[i]);
+    if (images.length) {
+        result.hero_src = images[0].src || images[0].getAttribute("src");
+        result.hero_srcset = images[0].getAttribute("srcset");
+        result.img_selector_index = i;
+        break;
     }
+}
+// Name and price, for products discovered without a listing page
+const heading = document.querySelector("h1");
+if (heading) result.name = (heading.innerText || heading.textContent || "").trim() || null;
+const price = findAll("//span[contains(@class, 'screen-reader-only') and contains(text(), 'Current price:')]")[0];
+if (price) result.price = (price.innerText || price.textContent || "").trim() || null;
+return result;
+"""
+
+def record_chain_result(selector_stats, chain, selectors, hit_index):
+    """Record the outcome of walking a selector chain that stopped at hit_index.
+
+    Selectors before the hit missed, selectors after it were never tried.
+    A hit_index of -1 means every selector in the chain missed.
+    """
+    tried = selectors if hit_index < 0 else selectors[:hit_index + 1]
+    for index, selector in enumerate(tried):
+        record_selector_result(selector_stats, chain, selector, index == hit_index)
+
+def extract_product_details(driver, selector_stats=None):
+    """Extract the item ID and hero image attributes from the current product page.
+
+    Returns a dict with item_id, hero_src, hero_srcset, name and price
+    (None when missing).
+    """
+    id_selectors = order_selectors(selector_stats, "item_id", ID_SELECTORS)
+    img_selectors = order_selectors(selector_stats, "detail_image", DETAIL_IMG_SELECTORS)
+    details = driver.execute_script(DETAIL_EXTRACTION_SCRIPT, id_selectors, ID_FALLBACK_SELECTOR, img_selectors) or {}
     
-    # Get category info or default to produce
-    category_info = category_mappings.get(category.lower(), category_mappings["produce"])
-    category_url = category_info["url"]
-    display_name = category_info["display_name"]
+    record_chain_result(selector_stats, "item_id", id_selectors, details.get('id_selector_index', -1))
+    record_chain_result(selector_stats, "detail_image", img_selectors, details.get('img_selector_index', -1))
+    return details
+
+def pick_image_url(srcset, src=None):
+    """Pick the image URL to keep from an img srcset, falling back to src."""
+    image_url = None
+    if srcset:  # Prefer srcset for highest resolution
+        srcset_parts = srcset.split(',')
+        if len(srcset_parts) >= 4:  # If we have the 4x version
+            # Get the last part which should be the highest resolution
+            image_url = srcset_parts[-1].strip().split(' ')[0].strip()
+        else:
+            # Take the first part if we don't have multiple resolutions
+            image_url = srcset_parts[0].strip().split(' ')[0].strip()
+    elif src:  # Use src if srcset is not available
+        image_url = src
     
-    driver.get(category_url)
-    print(f"Navigated to {display_name} URL: {category_url}")
+    # Make sure we have a clean URL without truncation issues
+    if image_url and image_url.endswith(","):
+        image_url = image_url[:-1]
+    return image_url or None
+
+def parse_product_html(html, page_url, id_selectors, img_selectors):
+    """Extract the same details as DETAIL_EXTRACTION_SCRIPT from captured page HTML.
+
+    Runs in parse worker processes, so it only takes and returns plain data.
+    The selectors are evaluated with lxml, which implements the same XPath
+    1.0 as the browser's document.evaluate.
+    """
+    from lxml import html as lxml_html
     
-    # Save HTML for debugging
-    html_source = driver.page_source
-    with open(f"{display_name}_page_source.html", "w", encoding="utf-8") as f:
-        f.write(html_source)
-    print(f"Saved page source to {display_name}_page_source.html for debugging")
+    try:
+        tree = lxml_html.fromstring(html)
+    except Exception as e:
+        # lxml's parser errors can't be pickled back to the crawler process
+        raise ValueError(f"Could not parse product page HTML: {e}") from None
+    result = {"item_id": None, "id_selector_index": -1, "hero_src": None, "hero_srcset": None,
+              "img_selector_index": -1, "name": None, "price": None}
+    for index, selector in enumerate(id_selectors):
+        for element in tree.xpath(selector):
+            item_id = parse_item_id(element.text_content().strip(), loose=selector == ID_FALLBACK_SELECTOR)
+            if item_id:
+                result["item_id"] = item_id
+                result["id_selector_index"] = index
+                break
+        if result["item_id"]:
+            break
+    for index, selector in enumerate(img_selectors):
+        images = tree.xpath(selector)
+        if images:
+            # Like img.src in the browser, resolve the URL against the page
+            src = images[0].get("src")
+            result["hero_src"] = urllib.parse.urljoin(page_url, src) if src else None
+            result["hero_srcset"] = images[0].get("srcset")
+            result["img_selector_index"] = index
+            break
+    # Name and price, for products discovered without a listing page
+    headings = tree.xpath("//h1")
+    if headings:
+        result["name"] = headings[0].text_content().strip() or None
+    prices = tree.xpath("//span[contains(@class, 'screen-reader-only') and contains(text(), 'Current price:')]")
+    if prices:
+        result["price"] = prices[0].text_content().strip() or None
+    return result
+
+def parse_product_details(html, page_url, selector_stats=None):
+    """Extract the product details from captured page HTML in this process.
+
+    The offline counterpart of extract_product_details: same selector order,
+    same result and the same selector stats updates, without a browser.
+    """
+    id_selectors = order_selectors(selector_stats, "item_id", ID_SELECTORS)
+    img_selectors = order_selectors(selector_stats, "detail_image", DETAIL_IMG_SELECTORS)
+    details = parse_product_html(html, page_url, id_selectors, img_selectors)
     
-    # Handle any popups that might appear
+    record_chain_result(selector_stats, "item_id", id_selectors, details.get('id_selector_index', -1))
+    record_chain_result(selector_stats, "detail_image", img_selectors, details.get('img_selector_index', -1))
+    return details
+
+def open_product_page(driver, product_info, archive=None, capture=False):
+    """Load a product page in the browser (or its recorded copy when replaying).
+
+    With capture=True, returns the page HTML for parsing outside the browser;
+    recorded pages are then read straight from the archive.
+    """
+    if archive is not None and archive.mode == "replay":
+        html = archive.lookup(product_info['url'], "detail")
+        if capture:
+            return html
+        load_archived_page(driver, product_info['url'], html)
+        return None
+    
+    # Navigate to the product page
+    driver.get(product_info['url'])
+    pause(driver, 3)  # Wait for the page to load
+    
+    # Handle any popups
     handle_popups(driver)
     
-    # Wait for page to fully load with a longer timeout
-    print("Waiting for page to fully load...")
-    time.sleep(10)
+    html = None
+    if capture or (archive is not None and archive.mode == "record"):
+        html = driver.page_source
+    if archive is not None and archive.mode == "record":
+        archive.record(product_info['url'], "detail", html)
+    return html
+
+def complete_product(product_info, details, position):
+    """Fill in a listing record from the details found on its product page and return it."""
+    item_id = details.get('item_id')
+    if item_id:
+        logger.info("Found item ID: %s", item_id, extra={"sample": "item_id_found"})
+    else:
+        # The page loaded but has no item label, so fall back to the ID in the URL
+        logger.warning("Could not find item ID on the product page")
+        item_id = url_item_id(product_info['url'], position)
     
-    # Take screenshot for debugging
-    driver.save_screenshot(f"{display_name}_page_loaded.png")
-    print(f"Saved screenshot of {display_name} page after loading")
+    # Prefer the high-resolution hero image over the listing thumbnail
+    image_url = pick_image_url(details.get('hero_srcset'), details.get('hero_src')) or product_info['image_url']
     
-    # Scroll to load all items (lazy loading)
-    print("Scrolling to load all products...")
-    scroll_attempts = 0
-    max_scroll_attempts = 15  # Increased from 10 to allow more scrolling attempts
-    last_height = driver.execute_script("return document.body.scrollHeight")
+    # Products found without a listing page take their name and price from here
+    name = product_info['name'] or details.get('name') or "Unnamed Product"
+    price = product_info['price'] or details.get('price') or "Price not found"
     
-    while scroll_attempts < max_scroll_attempts:
-        # Scroll down progressively (25% of viewport height at a time)
-        # This gives the page more time to load items as we scroll
-        current_height = driver.execute_script("return Math.max(document.documentElement.scrollTop, document.body.scrollTop);")
-        viewport_height = driver.execute_script("return window.innerHeight;")
-        next_scroll_position = min(current_height + viewport_height * 0.75, last_height)
-        
-        # Scroll to the next position
-        driver.execute_script(f"window.scrollTo(0, {next_scroll_position});")
-        print(f"Scrolled down progressively (attempt {scroll_attempts + 1})")
-        
-        # Wait for new items to load - increased from 3 to 5 seconds
-        time.sleep(5)
-        
-        # Calculate new scroll height and compare with last scroll height
-        new_height = driver.execute_script("return document.body.scrollHeight")
-        
-        # If we're at the bottom of the page or close to it
-        if current_height + viewport_height >= last_height * 0.95:
-            if new_height == last_height:
-                # Try once more before breaking
-                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-                time.sleep(5)  # Increased wait time
-                newer_height = driver.execute_script("return document.body.scrollHeight")
-                if newer_height == new_height:
-                    print("Reached end of page after scrolling")
-                    break
-        
-        last_height = new_height
-        scroll_attempts += 1
+    product_info['name'] = name
+    product_info['id'] = item_id
+    product_info['image_url'] = image_url
+    product_info['price'] = price
+    return product_info
+
+@traced_step
+def scrape_product_page(driver, product_info, position, selector_stats=None, archive=None):
+    """Visit a product page and return the complete item.
+
+    The listing record is completed in place and returned (a plain dict is
+    turned into a ProductRecord first). Raises an exception if the page could
+    not be loaded or the item ID lookup failed, so the caller can queue the
+    page for a retry; the record is left untouched then. With a replay
+    archive, the recorded page is parsed offline and the browser isn't used.
+    """
+    product_info = ProductRecord.from_mapping(product_info)
+    if archive is not None and archive.mode == "replay":
+        # Rendering a recorded page in the browser would only add round trips
+        details = parse_product_details(archive.lookup(product_info['url'], "detail"), product_info['url'],
+                                        selector_stats)
+        return complete_product(product_info, details, position)
     
-    # Take a final screenshot after scrolling
-    driver.save_screenshot("after_scrolling.png")
+    open_product_page(driver, product_info, archive)
     
-    # Based on the provided HTML structure, use these precise selectors
-    # Target the structure: <a role="button" href="/store/costco/products/[ID]-[NAME]" class="...">
-    product_selectors = [
-        "//a[@role='button' and contains(@href, '/store/costco/products/')]",
-        "//a[contains(@href, '/store/costco/products/')]",
-        "//div[contains(@class, 'e-19idom')]/ancestor::a",
-        "//div[contains(@class, 'e-bjn8wh')]/ancestor::a",
-        "//span[contains(@class, 'screen-reader-only') and contains(text(), 'Current price:')]/ancestor::a",
-        "//img[@data-testid='item-card-image']/ancestor::a"
-    ]
+    # Read the item ID and hero image in a single round trip
+    # Errors here are not caught: a page that throws during the lookup is retried later
+    details = extract_product_details(driver, selector_stats)
+    return complete_product(product_info, details, position)
+
+class PageHedger:
+    """Races product page loads that take unusually long against a spare browser.
+
+    Load times are tracked, and once min_samples are known, a load still
+    running after k times their p95 is hedged: the same page is opened on a
+    spare, already located browser, and whichever load finishes first is
+    used. If the spare wins, the two browsers swap roles and the slow one
+    finishes its load in the background before it is used again. Once loads
+    can be hedged, they get a page-load timeout of twice the hedge deadline:
+    the hedge has as long as the slow load had, and a hung loser is then cut
+    off instead of holding its browser for WebDriver's default 300 seconds. Hedge
+    counts and the time saved (how much later the losing load finished) are
+    kept for the run summary.
+    """
     
-    products = []
-    used_selector = None
+    def __init__(self, driver_factory, k=3.0, percentile=0.95, min_samples=20, window=200, min_deadline=5.0):
+        self.driver_factory = driver_factory
+        self.k = k
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_deadline = min_deadline
+        self.latencies = collections.deque(maxlen=window)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=3)
+        self.spare = None
+        self.spare_start = None  # Future starting the spare browser
+        self.spare_load = None  # Future of a load still running on the spare
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
     
-    for selector in product_selectors:
-        try:
-            print(f"Trying product selector: {selector}")
-            product_elements = driver.find_elements(By.XPATH, selector)
-            if product_elements and len(product_elements) > 0:
-                print(f"Found {len(product_elements)} products with selector: {selector}")
-                products = product_elements
-                used_selector = selector
-                break
-        except Exception as e:
-            print(f"Error with selector {selector}: {e}")
+    def deadline(self):
+        """Seconds after which a load is hedged (None until enough loads were timed)."""
+        if len(self.latencies) < self.min_samples:
+            return None
+        latencies = sorted(self.latencies)
+        p95 = latencies[min(len(latencies) - 1, int(self.percentile * len(latencies)))]
+        return max(self.min_deadline, p95 * self.k)
     
-    if not products:
-        print("Could not find any products with our selectors. Saving page for debugging.")
-        driver.save_screenshot("no_products_found.png")
-        
-        # Look for any links that might be products
-        print("Looking for any links that might be products...")
-        links = driver.find_elements(By.TAG_NAME, "a")
-        product_links = [link for link in links if '/products/' in (link.get_attribute('href') or '')]
+    def _ready_spare(self):
+        """Return the spare browser if it is started and idle, starting it in the background otherwise."""
+        if self.spare is None:
+            if self.spare_start is None:
+                logger.info("Starting a spare browser for hedged page loads")
+                self.spare_start = self.executor.submit(self.driver_factory)
+                return None
+            if not self.spare_start.done():
+                return None
+            try:
+                self.spare = self.spare_start.result()
+            except Exception as e:
+                logger.warning("Could not start the spare browser, not hedging: %s", e)
+            if self.spare is None:
+                self.driver_factory = None
+                return None
+        if self.spare_load is not None and not self.spare_load.done():
+            return None
+        return self.spare
+    
+    def _bound_load(self, driver, deadline, crawl_deadline=None):
+        """Set the page-load timeout of a hedged load, never past the crawl's own deadline."""
+        seconds = deadline * 2
+        if crawl_deadline is not None:
+            seconds = min(seconds, max(1, crawl_deadline - time.time()))
+        driver.set_page_load_timeout(seconds)
+    
+    def _loser_finished(self, future, won_at):
+        # A hung load that ends in a timeout or a dead session still held the page up until now
+        if not future.cancelled():
+            self.saved_seconds += time.time() - won_at
+    
+    def open(self, driver, product_info, archive=None, crawl_deadline=None):
+        """Load a product page, hedging it if it runs late, and return the browser that has it.
+
+        crawl_deadline (a time.time() value) caps the page-load timeouts of
+        both loads.
+        """
+        if archive is not None and archive.mode == "replay":
+            open_product_page(driver, product_info, archive)
+            return driver
         
-        if product_links:
-            print(f"Found {len(product_links)} potential product links")
-            products = product_links
-        else:
-            print("No product links found at all.")
-            return []
+        deadline = self.deadline()
+        if deadline is not None and self.driver_factory is not None:
+            self._ready_spare()  # Warm the spare up before the first slow page
+            self._bound_load(driver, deadline, crawl_deadline)
+        started = time.time()
+        # The archive's SQLite connection stays on this thread, so record after the load
+        primary = self.executor.submit(open_product_page, driver, product_info)
+        done, _ = concurrent.futures.wait([primary], timeout=deadline)
+        
+        first = primary
+        loaded_by = driver
+        spare = self._ready_spare() if not done and self.driver_factory is not None else None
+        if spare is not None:
+            self.hedges += 1
+            logger.info("Page load over %.1fs, hedging on the spare browser: %s", deadline, product_info['url'],
+                        extra={"sample": "hedge"})
+            self._bound_load(spare, deadline, crawl_deadline)
+            hedge = self.executor.submit(open_product_page, spare, product_info)
+            done, _ = concurrent.futures.wait([primary, hedge], return_when=concurrent.futures.FIRST_COMPLETED)
+            first = primary if primary in done else hedge
+            other = hedge if first is primary else primary
+            if first.exception() is not None:
+                # A failed load doesn't count as finishing first
+                concurrent.futures.wait([other])
+                if other.exception() is None:
+                    first, other = other, first
+            if first is hedge and first.exception() is None:
+                self.hedge_wins += 1
+                other.add_done_callback(functools.partial(self._loser_finished, won_at=time.time()))
+                self.spare, loaded_by = driver, spare
+            # Whichever load runs on the browser that is now the spare must end before it is used again
+            self.spare_load = primary if loaded_by is spare else hedge
+        
+        first.result()  # Raises if the page couldn't be loaded at all
+        self.latencies.append(time.time() - started)
+        if archive is not None and archive.mode == "record":
+            archive.record(product_info['url'], "detail", loaded_by.page_source)
+        return loaded_by
     
-    # First extract basic info from the listing page
-    product_list = []
-    seen_urls = set()  # Track URLs to avoid duplicates
+    def summary(self):
+        return {
+            "hedged": self.hedges,
+            "won": self.hedge_wins,
+            "saved_seconds": round(self.saved_seconds, 1),
+            "deadline_seconds": round(self.deadline(), 1) if self.deadline() is not None else None
+        }
     
-    for i, product in enumerate(products):
+    def close(self):
+        """Quit the spare browser, giving a load still running on it a moment to end."""
+        if self.spare_load is not None:
+            concurrent.futures.wait([self.spare_load], timeout=30)
+        if self.spare is None and self.spare_start is not None:
+            concurrent.futures.wait([self.spare_start])
+            if self.spare_start.exception() is None:
+                self.spare = self.spare_start.result()
+        if self.spare is not None:
+            try:
+                self.spare.quit()
+            except Exception as e:
+                logger.warning("Error closing the spare browser: %s", e)
+        self.executor.shutdown(wait=False)
+
+def retry_delay(attempt, base_delay=2.0, max_delay=60.0):
+    """Return the backoff delay in seconds before the given retry attempt.
+
+    The delay doubles with each attempt (capped at max_delay) and half of it
+    is randomized so that retries of neighbouring pages don't line up.
+    """
+    delay = min(max_delay, base_delay * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def failure_record(entry, category):
+    """Build the failure report row for a retry queue entry."""
+    product_info = entry['product_info']
+    return {
+        "category": category,
+        "name": product_info['name'],
+        "url": product_info['url'],
+        "page_position": product_info.get('page_position', entry['position']),
+        "attempts": entry['attempts'],
+        "error": entry['last_error']
+    }
+
+def retry_failed_pages(driver, retry_queue, category, max_attempts=3, driver_factory=None, selector_stats=None,
+                       archive=None, watchdog=None, deadline=None, item_cost=None):
+    """Retry the product pages that failed during the main pass.
+
+    Each entry in retry_queue is a dict with the product info, its position,
+    the number of attempts made so far and the last error. Pages are retried
+    with exponential backoff until they succeed or reach max_attempts.
+    With a deadline, pages whose retry would not finish in time (according
+    to item_cost) are given up on right away.
+    Returns a tuple of (items, failures).
+    """
+    items = []
+    failures = []
+    if not retry_queue:
+        return items, failures
+    
+    logger.info("Retrying %s failed product pages (max %s attempts each)", len(retry_queue), max_attempts)
+    
+    # Optionally use a fresh browser, in case the failures came from a bad session
+    retry_driver = driver
+    fresh_driver = None
+    if driver_factory is not None and deadline is not None and time.time() + BROWSER_STARTUP_SECONDS > deadline:
+        logger.info("Not enough time left for a fresh driver, retrying with the current one")
+    elif driver_factory is not None:
+        logger.info("Starting a fresh driver for retries...")
         try:
-            # Get the product URL
-            item_url = product.get_attribute("href")
-            if not item_url.startswith("http"):
-                # Convert relative URL to absolute
-                if item_url.startswith("/"):
-                    base_url = "https://sameday.costco.com"
-                    item_url = base_url + item_url
-            
-            # Skip if we've already seen this URL
-            if item_url in seen_urls:
-                print(f"Skipping duplicate product with URL: {item_url}")
-                continue
+            fresh_driver = driver_factory()
+        except Exception as e:
+            logger.warning("Could not start a fresh driver, retrying with the current one: %s", e)
+        if fresh_driver is not None:
+            retry_driver = fresh_driver
+    
+    # Schedule the first retry of each page
+    for entry in retry_queue:
+        entry['next_attempt_at'] = time.time() + retry_delay(entry['attempts'])
+    
+    pending = list(retry_queue)
+    try:
+        while pending:
+            # Always work on the page whose backoff expires first
+            pending.sort(key=lambda e: e['next_attempt_at'])
+            entry = pending.pop(0)
+            wait_time = entry['next_attempt_at'] - time.time()
+            if deadline is not None and item_cost is not None and not item_cost.fits(deadline, max(wait_time, 0)):
+                # Backoffs only grow, so no other pending page fits either
+                logger.warning("Time budget nearly used up, giving up on %s pages still to retry", len(pending) + 1)
+                for remaining in [entry] + pending:
+                    remaining['last_error'] = f"{remaining['last_error']} (no time left to retry)"
+                    failures.append(failure_record(remaining, category))
+                break
+            if wait_time > 0:
+                time.sleep(wait_time)
             
-            # Add URL to our set of seen URLs
-            seen_urls.add(item_url)
+            # The crawl's own browser may be due for recycling
+            if watchdog is not None and fresh_driver is None:
+                retry_driver = watchdog.checkpoint()
+            limit_page_load(retry_driver, deadline)
             
-            print(f"Processing product {i+1}/{len(products)} from list page")
+            product_info = entry['product_info']
+            entry['attempts'] += 1
+            logger.info("Retry attempt %s/%s for: %s", entry['attempts'], max_attempts, product_info['name'] or product_info['url'])
+            logger.info("URL: %s", product_info['url'])
             
-            # Get product name from the listing page
             try:
-                # First try to find element with class that matches product name
-                name_element = product.find_element(By.XPATH, ".//div[contains(@class, 'e-147kl2c')]")
-                item_name = name_element.text.strip()
-            except:
-                try:
-                    # Fallback to heading role
-                    name_element = product.find_element(By.XPATH, ".//*[@role='heading']")
-                    item_name = name_element.text.strip()
-                except:
-                    # Other fallbacks
-                    try:
-                        non_price_texts = [el.text for el in product.find_elements(By.XPATH, ".//*[not(contains(text(), '$'))]") if el.text.strip()]
-                        if non_price_texts:
-                            item_name = max(non_price_texts, key=len).strip()
-                        else:
-                            item_name = f"Unnamed Product {i+1}"
-                    except:
-                        item_name = f"Unnamed Product {i+1}"
-            
-            # Get product price from the listing page
+                item = scrape_product_page(retry_driver, product_info, entry['position'], selector_stats, archive)
+                items.append(item)
+                logger.info("Added product with ID %s on retry: %s - %s", item['id'], item['name'], item['price'])
+            except Exception as e:
+                entry['last_error'] = str(e).strip().splitlines()[0] if str(e).strip() else repr(e)
+                logger.warning("Retry failed for %s: %s", product_info['url'], entry['last_error'])
+                if deadline is not None and time.time() >= deadline:
+                    # Cut off by the time budget; the pages still pending are given up on next
+                    entry['last_error'] = f"{entry['last_error']} (no time left to retry)"
+                    failures.append(failure_record(entry, category))
+                elif entry['attempts'] < max_attempts:
+                    entry['next_attempt_at'] = time.time() + retry_delay(entry['attempts'])
+                    pending.append(entry)
+                else:
+                    logger.warning("Giving up on %s after %s attempts", product_info['url'], entry['attempts'])
+                    failures.append(failure_record(entry, category))
+    finally:
+        if fresh_driver is not None:
+            fresh_driver.quit()
+    
+    logger.info("Recovered %s of %s failed product pages", len(items), len(retry_queue))
+    return items, failures
+
+class PageArchive:
+    """Compressed archive of the pages fetched during a crawl, indexed by URL.
+
+    In "record" mode the final DOM of every listing scroll step and product
+    page is stored; in "replay" mode the crawl reads pages from here instead
+    of the live site. Pages are zlib-compressed in a SQLite file, together
+    with the category being crawled (set category before recording), so one
+    archive can hold several crawls.
+    """
+    
+    def __init__(self, path, mode="replay"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown archive mode: {mode}")
+        if mode == "replay" and not os.path.exists(path):
+            raise FileNotFoundError(f"Page archive not found: {path}")
+        self.path = path
+        self.mode = mode
+        self.steps = {}  # (url, kind) -> next step number recorded in this session
+        self.category = None  # Category of the pages recorded next
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                step INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                html BLOB NOT NULL,
+                category TEXT,
+                PRIMARY KEY (url, kind, step)
+            )""")
+        # Archives recorded before categories were stored have no category column
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(pages)")]
+        if "category" not in columns:
+            self.conn.execute("ALTER TABLE pages ADD COLUMN category TEXT")
+    
+    def record(self, url, kind, html):
+        """Store a page snapshot; repeated snapshots of a URL are kept as steps."""
+        key = (url, kind)
+        if key not in self.steps:
+            # A new recording replaces whatever an earlier run stored for this page
+            self.conn.execute("DELETE FROM pages WHERE url = ? AND kind = ?", key)
+            self.steps[key] = 0
+        self.conn.execute("INSERT OR REPLACE INTO pages (url, kind, step, fetched_at, html, category) VALUES (?, ?, ?, ?, ?, ?)",
+                          (url, kind, self.steps[key], time.time(), zlib.compress(html.encode("utf-8")), self.category))
+        self.conn.commit()
+        self.steps[key] += 1
+    
+    def snapshots(self, url, kind):
+        """Return all recorded snapshots of a page, in recording order."""
+        rows = self.conn.execute("SELECT html FROM pages WHERE url = ? AND kind = ? ORDER BY step",
+                                 (url, kind)).fetchall()
+        return [zlib.decompress(row[0]).decode("utf-8") for row in rows]
+    
+    def lookup(self, url, kind):
+        """Return the last recorded snapshot of a page."""
+        snapshots = self.snapshots(url, kind)
+        if not snapshots:
+            raise KeyError(f"Page not in archive: {url}")
+        return snapshots[-1]
+    
+    def urls(self, kind, category):
+        """Return the URLs recorded for a kind of page of a category, in recording order.
+
+        Category None matches the pages of archives recorded before the
+        category was stored.
+        """
+        rows = self.conn.execute("""
+            SELECT url FROM pages WHERE kind = ? AND category IS ?
+            GROUP BY url ORDER BY MIN(rowid)""", (kind, category)).fetchall()
+        return [row[0] for row in rows]
+    
+    def has_pages(self, kind):
+        """Return True if any page of a kind was recorded."""
+        return self.conn.execute("SELECT 1 FROM pages WHERE kind = ? LIMIT 1", (kind,)).fetchone() is not None
+    
+    def close(self):
+        self.conn.close()
+
+def recorded_category(archive, category, category_map=None):
+    """Look up a category in a replay archive.
+
+    Returns the category info, with the listing URL the pages were recorded
+    under (even if the map has moved the category on since), and the product
+    URLs to replay when the crawl recorded no listing page (None otherwise).
+    Categories the map doesn't know are replayed if the archive has their
+    pages. Raises CategoryUrlError if it has none.
+    """
+    key = category.lower() if category is not None else "sitemap"
+    try:
+        category_info = dict(category_map.get(key) if category_map is not None else get_category_info(key))
+    except CategoryUrlError:
+        category_info = {"url": None, "display_name": key}
+    
+    listing_urls = archive.urls("listing", key)
+    if listing_urls:
+        category_info["url"] = listing_urls[-1]
+        return category_info, None
+    detail_urls = archive.urls("detail", key)
+    if detail_urls:
+        return category_info, detail_urls
+    
+    # Archives from before categories were stored: only the listing URL tells the crawls apart
+    if category_info["url"] and archive.snapshots(category_info["url"], "listing"):
+        return category_info, None
+    if not archive.has_pages("listing") and archive.urls("detail", None):
+        # Only product pages, so the archive holds a single sitemap crawl
+        return category_info, archive.urls("detail", None)
+    raise CategoryUrlError(f"No pages of category '{key}' in the archive {archive.path}")
+
+def load_archived_page(driver, url, html):
+    """Load a recorded page into the browser without touching the network.
+
+    Scripts are stripped so the recorded DOM is not re-rendered, and a <base>
+    tag keeps relative links resolving against the original URL.
+    """
+    html = re.sub(r"<script\b[^>]*>.*?</script>", "", html, flags=re.IGNORECASE | re.DOTALL)
+    base_tag = f'<base href="{url}">'
+    if re.search(r"<head\b[^>]*>", html, flags=re.IGNORECASE):
+        html = re.sub(r"(<head\b[^>]*>)", lambda m: m.group(1) + base_tag, html, count=1, flags=re.IGNORECASE)
+    else:
+        html = base_tag + html
+    driver.execute_script("document.open(); document.write(arguments[0]); document.close();", html)
+
+def start_replay_session(headless=True):
+    """Start a browser for replaying an archive, with network access switched off."""
+    driver = setup_driver(headless=headless)
+    driver.get("about:blank")
+    # Recorded pages must not fetch anything from the live site
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.emulateNetworkConditions", {
+        "offline": True, "latency": 0, "downloadThroughput": -1, "uploadThroughput": -1})
+    return driver
+
+def open_sitemap(source):
+    """Open a sitemap from a URL, file:// URL or local path as a binary stream.
+
+    Gzip-compressed sitemaps (.xml.gz) are decompressed on the fly.
+    """
+    # Pulls in ssl, so only import it when a sitemap is actually read
+    import urllib.request
+    
+    if source.startswith("http://") or source.startswith("https://"):
+        request = urllib.request.Request(source, headers={"User-Agent": "Mozilla/5.0"})
+        stream = urllib.request.urlopen(request, timeout=30)
+    elif source.startswith("file://"):
+        stream = open(urllib.request.url2pathname(urllib.parse.urlparse(source).path), 'rb')
+    else:
+        stream = open(source, 'rb')
+    
+    if source.endswith(".gz"):
+        return gzip.GzipFile(fileobj=stream)
+    return stream
+
+def iter_sitemap_urls(source):
+    """Yield every page URL listed in a sitemap, following sitemap index files.
+
+    The XML is parsed incrementally, so large sitemaps are never held in memory.
+    """
+    nested_sitemaps = []
+    with open_sitemap(source) as stream:
+        for _, element in ElementTree.iterparse(stream, events=("end",)):
+            # Tags are normally namespaced, but accept sitemaps written without the namespace
+            tag = element.tag.rsplit('}', 1)[-1]
+            if tag == "sitemap":
+                loc = element.findtext(SITEMAP_NAMESPACE + "loc") or element.findtext("loc")
+                if loc:
+                    nested_sitemaps.append(loc.strip())
+                element.clear()
+            elif tag == "url":
+                loc = element.findtext(SITEMAP_NAMESPACE + "loc") or element.findtext("loc")
+                if loc:
+                    yield loc.strip()
+                element.clear()
+    
+    # A sitemap index points at further sitemaps
+    for nested in nested_sitemaps:
+        # Resolve relative locations against the index itself
+        if not urllib.parse.urlparse(nested).scheme and not os.path.isabs(nested):
+            if "://" in source:
+                nested = urllib.parse.urljoin(source, nested)
+            else:
+                nested = os.path.join(os.path.dirname(source), nested)
+        logger.info("Reading nested sitemap: %s", nested)
+        yield from iter_sitemap_urls(nested)
+
+def discover_sitemap_products(sitemap_url, cache_file=None, ttl_hours=24, url_filter=None):
+    """Return the product URLs listed in the site's sitemap.
+
+    Results are cached in cache_file and reused until they are older than
+    ttl_hours. If url_filter is given, only URLs containing it are kept.
+    """
+    if cache_file and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            age_hours = (time.time() - cache["fetched_at"]) / 3600
+            if cache.get("sitemap_url") == sitemap_url and age_hours < ttl_hours:
+                logger.info("Using cached sitemap from %s (%.1f hours old)", cache_file, age_hours)
+                return [url for url in cache["urls"] if not url_filter or url_filter in url]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Could not read sitemap cache %s: %s", cache_file, e)
+    
+    logger.info("Enumerating product URLs from sitemap: %s", sitemap_url)
+    urls = []
+    seen_urls = set()
+    for url in iter_sitemap_urls(sitemap_url):
+        if PRODUCT_URL_MARKER in url and url not in seen_urls:
+            seen_urls.add(url)
+            urls.append(url)
+    logger.info("Found %s product URLs in sitemap", len(urls))
+    
+    if cache_file:
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump({"sitemap_url": sitemap_url, "fetched_at": time.time(), "urls": urls}, f)
+        logger.info("Sitemap cached to %s", cache_file)
+    
+    return [url for url in urls if not url_filter or url_filter in url]
+
+def products_from_urls(product_urls):
+    """Build listing entries for product URLs found without a listing page.
+
+    Name and price are unknown until the product page itself is visited.
+    """
+    return [ProductRecord(url=url, image_url="Image not found", page_position=i+1)
+            for i, url in enumerate(product_urls)]
+
+# Page whose navigation links to every department and collection
+CATEGORY_DISCOVERY_URL = "https://sameday.costco.com/store/costco/storefront"
+COLLECTION_URL_MARKER = "/store/costco/collections/"
+
+# Collects the collection links in the site navigation (and anywhere else on the page)
+COLLECTION_LINKS_SCRIPT = """
+var marker = arguments[0];
+var links = [];
+var anchors = document.querySelectorAll('a[href*="' + marker + '"]');
+for (var i = 0; i < anchors.length; i++) {
+    links.push({href: anchors[i].href, text: (anchors[i].textContent || '').trim()});
+}
+return links;
+"""
+
+# Whether the page that was just loaded is the collection that was asked for:
+# not an error response, and not redirected somewhere else (usually the
+# storefront) because the collection no longer exists
+LISTING_RESOLVES_SCRIPT = """
+var path = arguments[0];
+var nav = performance.getEntriesByType('navigation')[0];
+var status = nav && nav.responseStatus ? nav.responseStatus : 0;
+return status < 400 && window.location.pathname.indexOf(path) === 0;
+"""
+
+def collection_slug(url):
+    """Return the collection part of a collection URL, without its numeric ID.
+
+    "https://.../collections/n-bakery-desserts-23722?x=1" -> "n-bakery-desserts"
+    """
+    path = urllib.parse.urlsplit(url).path
+    if COLLECTION_URL_MARKER not in path:
+        return None
+    slug = path.split(COLLECTION_URL_MARKER, 1)[1].strip("/").split("/")[0]
+    return re.sub(r"-\d+$", "", slug) or None
+
+def discover_categories(driver):
+    """Read the category -> collection URL map from the site navigation.
+
+    Collections that match a built-in category keep its name, so
+    "--category bakery" still works after the collection ID changes. Other
+    collections are named after their slug (e.g. "n-holiday-shop-123" ->
+    "holiday-shop").
+    """
+    driver.get(CATEGORY_DISCOVERY_URL)
+    handle_popups(driver)
+    pause(driver, 5)
+    links = driver.execute_script(COLLECTION_LINKS_SCRIPT, COLLECTION_URL_MARKER) or []
+    
+    builtin = {collection_slug(info["url"]): (category, info["display_name"])
+               for category, info in CATEGORY_MAPPINGS.items()}
+    categories = {}
+    for link in links:
+        parts = urllib.parse.urlsplit(link["href"])
+        url = urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip("/"), "", ""))
+        slug = collection_slug(url)
+        if not slug:
+            continue
+        if slug in builtin:
+            category, display_name = builtin[slug]
+        else:
+            category = display_name = re.sub(r"^(n|rc)-", "", slug)
+        categories.setdefault(category, {"url": url, "display_name": display_name})
+    logger.info("Discovered %s categories from the site navigation", len(categories))
+    return categories
+
+def listing_resolves(driver, category_url):
+    """Check that the page just loaded really is the collection at category_url."""
+    path = urllib.parse.urlsplit(category_url).path.rstrip("/")
+    return bool(driver.execute_script(LISTING_RESOLVES_SCRIPT, path))
+
+class CategoryUrlError(Exception):
+    """A category is unknown, or its collection URL no longer leads to its collection page."""
+
+class CategoryMap:
+    """Category names mapped to collection URLs, cached on disk.
+
+    Starts from the cache file, or from the built-in CATEGORY_MAPPINGS when
+    there is none. The site navigation is only read again when a cached URL
+    stops resolving, or when an unknown category is asked for and the map is
+    older than ttl_hours, so most runs pay no discovery cost. Lookups and
+    refreshes hold a lock, so the daemon's request threads share one map and
+    never rediscover it twice at the same time.
+    """
+    
+    def __init__(self, cache_file="category_cache.json", ttl_hours=168):
+        self.cache_file = cache_file
+        self.ttl_hours = ttl_hours
+        self.lock = threading.RLock()
+        self.categories = dict(CATEGORY_MAPPINGS)
+        self.discovered_at = 0  # Built-in map: never discovered
+        if cache_file and os.path.exists(cache_file):
             try:
-                price_element = product.find_element(By.XPATH, ".//span[contains(@class, 'screen-reader-only') and contains(text(), 'Current price:')]")
-                item_price = price_element.text.strip()
-            except:
-                try:
-                    # Alternative: Look for any text with $ sign
-                    price_elements = product.find_elements(By.XPATH, ".//*[contains(text(), '$')]")
-                    if price_elements:
-                        item_price = price_elements[0].text.strip()
-                    else:
-                        item_price = "Price not found"
-                except:
-                    item_price = "Price not found"
-            
-            # Get product image URL from the listing page
+                with open(cache_file, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                self.categories = cache["categories"]
+                self.discovered_at = cache["discovered_at"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Could not read category cache %s, using built-in categories: %s", cache_file, e)
+    
+    def expired(self):
+        return (time.time() - self.discovered_at) / 3600 >= self.ttl_hours
+    
+    def get(self, category, driver=None):
+        """Return the URL and display name of a category.
+
+        Unknown categories trigger a discovery when the map is out of date
+        and a driver is given; categories that are still unknown raise
+        CategoryUrlError instead of silently falling back to produce.
+        """
+        category = category.lower()
+        with self.lock:
+            if category not in self.categories and driver is not None and self.expired():
+                logger.info("Category '%s' is not in the category map, looking for it on the site", category)
+                self.refresh(driver)
+            if category not in self.categories:
+                raise CategoryUrlError(f"Unknown category '{category}' (known: {', '.join(sorted(self.categories))})")
+            return dict(self.categories[category])
+    
+    def refresh(self, driver):
+        """Rediscover the categories from the site and save them to the cache.
+
+        Categories the navigation no longer links to are kept, in case they
+        still resolve. Returns False if nothing was found.
+        """
+        with self.lock:
+            found = discover_categories(driver)
+            if not found:
+                logger.warning("No categories found in the site navigation, keeping the current map")
+                return False
+            self.categories.update(found)
+            self.discovered_at = time.time()
+            if self.cache_file:
+                # Workers may share the cache file, so never leave a half-written one behind
+                write_json_atomic(self.cache_file, {"discovered_at": self.discovered_at, "categories": self.categories},
+                                  indent=2)
+                logger.info("Category map cached to %s", self.cache_file)
+            return True
+    
+    def rediscover_url(self, category, failed_url, driver, error):
+        """Return a category's URL after rediscovering the map because failed_url stopped resolving.
+
+        Re-raises error when discovery found no different URL for it.
+        """
+        with self.lock:
+            if self.get(category)["url"] != failed_url:
+                # Another thread rediscovered the map while this one was loading failed_url
+                return self.get(category)["url"]
+            logger.warning("%s; rediscovering categories", error)
+            if not self.refresh(driver) or self.get(category)["url"] == failed_url:
+                raise error
+            return self.get(category)["url"]
+
+# Returns the href of every element matching the XPath in arguments[0], plus
+# [href, element] for the ones this document has not returned before. Element
+# references are the expensive part of the round-trip, so a card scrolled past
+# on an earlier step is only sent again as a URL. The seen set lives on window
+# and is therefore reset by every navigation.
+CARD_HARVEST_SCRIPT = """
+const seen = window.__costcoSeenCards || (window.__costcoSeenCards = new Set());
+const snapshot = document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+const hrefs = [];
+const cards = [];
+for (let i = 0; i < snapshot.snapshotLength; i++) {
+    const card = snapshot.snapshotItem(i);
+    const href = card.href || card.getAttribute("href") || "";
+    hrefs.push(href);
+    if (href && !seen.has(href)) {
+        seen.add(href);
+        cards.push([href, card]);
+    }
+}
+return {hrefs: hrefs, cards: cards};
+"""
+
+# Forgets a card so the next step returns its element again (after a failed read)
+CARD_FORGET_SCRIPT = "if (window.__costcoSeenCards) { window.__costcoSeenCards.delete(arguments[0]); }"
+
+def is_costco_product_url(url):
+    """Return True if url is an http(s) product page on costco.com."""
+    parsed = urllib.parse.urlparse(url or "")
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme in ("http", "https") and (host == "costco.com" or host.endswith(".costco.com")) \
+        and parsed.path.startswith(PRODUCT_URL_MARKER)
+
+def absolute_product_url(item_url):
+    """Convert a relative product link to an absolute URL."""
+    if item_url and not item_url.startswith("http") and item_url.startswith("/"):
+        return "https://sameday.costco.com" + item_url
+    return item_url
+
+def extract_card_info(product, item_url, position):
+    """Read the name, price and image of a product card on the listing page."""
+    from selenium.webdriver.common.by import By
+    
+    # Get product name from the listing page
+    try:
+        # First try to find element with class that matches product name
+        name_element = product.find_element(By.XPATH, ".//div[contains(@class, 'e-147kl2c')]")
+        item_name = name_element.text.strip()
+    except:
+        try:
+            # Fallback to heading role
+            name_element = product.find_element(By.XPATH, ".//*[@role='heading']")
+            item_name = name_element.text.strip()
+        except:
+            # Other fallbacks
             try:
-                # Look for the image with data-testid="item-card-image"
-                img_element = product.find_element(By.XPATH, ".//img[@data-testid='item-card-image']")
-                
-                # Try srcset first, which contains multiple resolution options
-                img_srcset = img_element.get_attribute("srcset")
-                if img_srcset:
-                    # Extract the highest resolution image (usually the 4x version at the end)
-                    srcset_parts = img_srcset.split(',')
-                    if srcset_parts and len(srcset_parts) >= 4:  # If we have the 4x version
-                        # Get the last part which should be the highest resolution
-                        highest_res_part = srcset_parts[-1].strip()
-                        # Extract the URL part before any whitespace
-                        item_img_url = highest_res_part.split(' ')[0].strip()
-                    elif srcset_parts:  # If we have at least one part
-                        # Take the first part if we don't have multiple resolutions
-                        first_part = srcset_parts[0].strip()
-                        item_img_url = first_part.split(' ')[0].strip()
-                    else:
-                        # Fallback to src if srcset parsing fails
-                        item_img_url = img_element.get_attribute("src")
+                non_price_texts = [el.text for el in product.find_elements(By.XPATH, ".//*[not(contains(text(), '$'))]") if el.text.strip()]
+                if non_price_texts:
+                    item_name = max(non_price_texts, key=len).strip()
                 else:
-                    # Fallback to src attribute
-                    item_img_url = img_element.get_attribute("src")
-                    
-                # Clean up the image URL if it contains filters or strange formatting
-                if item_img_url and "filters:" in item_img_url:
-                    # Try to extract the base URL before any filters
-                    base_img_url_parts = item_img_url.split("filters:")
-                    if len(base_img_url_parts) > 1:
-                        # Find the last part that looks like a valid URL
-                        for part in reversed(base_img_url_parts):
-                            if "http" in part:
-                                item_img_url = part[part.find("http"):]
-                                break
+                    item_name = f"Unnamed Product {position}"
             except:
-                try:
-                    # Fallback to any image
-                    img_element = product.find_element(By.XPATH, ".//img")
-                    item_img_url = img_element.get_attribute("src")
-                except:
-                    item_img_url = "Image not found"
-            
-            # Add to our list of products to visit
-            product_list.append({
-                "name": item_name,
-                "url": item_url,
-                "image_url": item_img_url,
-                "price": item_price,
-                "page_position": i+1
-            })
-            
-        except Exception as e:
-            print(f"Error extracting basic details for product {i+1}: {e}")
-            continue
+                item_name = f"Unnamed Product {position}"
     
-    # If max_items is set, limit the number of products to process
-    if max_items and max_items > 0 and len(product_list) > max_items:
-        print(f"Limiting to {max_items} products for testing (out of {len(product_list)} found)")
-        product_list = product_list[:max_items]
+    # Get product price from the listing page
+    try:
+        price_element = product.find_element(By.XPATH, ".//span[contains(@class, 'screen-reader-only') and contains(text(), 'Current price:')]")
+        item_price = price_element.text.strip()
+    except:
+        try:
+            # Alternative: Look for any text with $ sign
+            price_elements = product.find_elements(By.XPATH, ".//*[contains(text(), '$')]")
+            if price_elements:
+                item_price = price_elements[0].text.strip()
+            else:
+                item_price = "Price not found"
+        except:
+            item_price = "Price not found"
     
-    # Now navigate to each product page to get the actual Costco item ID
-    items = []
-    for i, product_info in enumerate(product_list):
+    # Get product image URL from the listing page
+    try:
+        # Look for the image with data-testid="item-card-image"
+        img_element = product.find_element(By.XPATH, ".//img[@data-testid='item-card-image']")
+    
+        # Try srcset first, which contains multiple resolution options
+        img_srcset = img_element.get_attribute("srcset")
+        if img_srcset:
+            # Extract the highest resolution image (usually the 4x version at the end)
+            srcset_parts = img_srcset.split(',')
+            if srcset_parts and len(srcset_parts) >= 4:  # If we have the 4x version
+                # Get the last part which should be the highest resolution
+                highest_res_part = srcset_parts[-1].strip()
+                # Extract the URL part before any whitespace
+                item_img_url = highest_res_part.split(' ')[0].strip()
+            elif srcset_parts:  # If we have at least one part
+                # Take the first part if we don't have multiple resolutions
+                first_part = srcset_parts[0].strip()
+                item_img_url = first_part.split(' ')[0].strip()
+            else:
+                # Fallback to src if srcset parsing fails
+                item_img_url = img_element.get_attribute("src")
+        else:
+            # Fallback to src attribute
+            item_img_url = img_element.get_attribute("src")
+    
+        # Clean up the image URL if it contains filters or strange formatting
+        if item_img_url and "filters:" in item_img_url:
+            # Try to extract the base URL before any filters
+            base_img_url_parts = item_img_url.split("filters:")
+            if len(base_img_url_parts) > 1:
+                # Find the last part that looks like a valid URL
+                for part in reversed(base_img_url_parts):
+                    if "http" in part:
+                        item_img_url = part[part.find("http"):]
+                        break
+    except:
         try:
-            print(f"\nVisiting product page {i+1}/{len(product_list)}: {product_info['name']}")
-            print(f"URL: {product_info['url']}")
-            
-            # Navigate to the product page
-            driver.get(product_info['url'])
-            time.sleep(3)  # Wait for the page to load
-            
-            # Handle any popups
-            handle_popups(driver)
-            
-            # Extract the actual Costco item ID
-            item_id = None
+            # Fallback to any image
+            img_element = product.find_element(By.XPATH, ".//img")
+            item_img_url = img_element.get_attribute("src")
+        except:
+            item_img_url = "Image not found"
+    
+    return ProductRecord(name=item_name, url=item_url, image_url=item_img_url, price=item_price,
+                         page_position=position)
+
+def find_cards(driver, selector):
+    """Run CARD_HARVEST_SCRIPT; returns the hrefs of all matching cards and [href, element] for the unseen ones."""
+    result = driver.execute_script(CARD_HARVEST_SCRIPT, selector) or {}
+    return result.get("hrefs") or [], result.get("cards") or []
+
+def harvest_cards(driver, harvested, card_selector=None, selector_stats=None, archive=None, page_url=None,
+                  page_urls=None):
+    """Add the product cards currently on the page to the harvested dict.
+
+    Only cards the page has not handed over on an earlier step, and whose URL
+    has not been harvested yet, are read. Returns the card selector to use for
+    the next step; if card_selector is None (or stopped matching), the product
+    selector chain is walked to pick one. When
+    recording, the DOM at each step is stored in the archive under page_url.
+    If page_urls (a set) is given, the URL of every card on the page is added
+    to it, harvested before or not.
+    """
+    if archive is not None and archive.mode == "record":
+        archive.record(page_url, "listing", driver.page_source)
+    
+    hrefs, cards = [], []
+    if card_selector:
+        hrefs, cards = find_cards(driver, card_selector)
+    
+    if not hrefs:
+        # Try the product selectors, most reliable first according to past runs
+        card_selector = None
+        for selector in order_selectors(selector_stats, "product_card", PRODUCT_SELECTORS):
             try:
-                # Look for the item ID in the format: <div class="e-16zy4wa">Item: 57554</div>
-                id_selectors = [
-                    "//div[contains(@class, 'e-16zy4wa')]",
-                    "//div[contains(text(), 'Item:')]",
-                    "//*[contains(text(), 'Item:')]"
-                ]
-                
-                for id_selector in id_selectors:
-                    id_elements = driver.find_elements(By.XPATH, id_selector)
-                    for id_element in id_elements:
-                        id_text = id_element.text.strip()
-                        if "Item:" in id_text:
-                            # Extract the numeric ID from "Item: XXXXX"
-                            item_id = id_text.split("Item:")[1].strip()
-                            print(f"Found item ID: {item_id}")
-                            break
-                    
-                    if item_id:
-                        break
-                
-                # If still not found, try additional methods
-                if not item_id:
-                    # Try to find any element that might contain the item ID
-                    potential_elements = driver.find_elements(By.XPATH, "//*[contains(text(), 'Item')]")
-                    for elem in potential_elements:
-                        text = elem.text.strip()
-                        if "Item" in text and ":" in text:
-                            # Try to extract numeric content after "Item:"
-                            parts = text.split(":")
-                            if len(parts) > 1:
-                                potential_id = parts[1].strip()
-                                # Check if it's numeric
-                                if potential_id.isdigit():
-                                    item_id = potential_id
-                                    print(f"Found item ID with alternative method: {item_id}")
-                                    break
-            
-                # If still not found, create a placeholder ID
-                if not item_id:
-                    print("Could not find item ID on the product page")
-                    # Extract ID from URL as fallback
-                    url_parts = product_info['url'].split('/')
-                    if len(url_parts) > 0:
-                        last_part = url_parts[-1]
-                        # The ID-like part is before the first dash
-                        url_id = last_part.split('-')[0] if '-' in last_part else last_part
-                        item_id = f"url-{url_id}"
-                    else:
-                        item_id = f"unknown-{i+1}"
-            
+                hrefs, cards = find_cards(driver, selector)
+                record_selector_result(selector_stats, "product_card", selector, bool(hrefs))
+                if hrefs:
+                    logger.info("Found %s products with selector: %s", len(hrefs), selector)
+                    card_selector = selector
+                    break
             except Exception as e:
-                print(f"Error extracting item ID: {e}")
-                # Use URL-based ID as fallback
-                url_parts = product_info['url'].split('/')
-                if len(url_parts) > 0:
-                    last_part = url_parts[-1]
-                    url_id = last_part.split('-')[0] if '-' in last_part else last_part
-                    item_id = f"url-{url_id}"
-                else:
-                    item_id = f"unknown-{i+1}"
-            
-            # Get a high-resolution product image from the detail page
+                logger.warning("Error with selector %s: %s", selector, e)
+                record_selector_result(selector_stats, "product_card", selector, False)
+    
+    if page_urls is not None:
+        page_urls.update(url for url in map(absolute_product_url, hrefs) if url)
+    
+    new_cards = 0
+    for href, product in cards:
+        item_url = absolute_product_url(href)
+        if not item_url or item_url in harvested:
+            continue
+        position = len(harvested) + 1
+        try:
+            harvested[item_url] = extract_card_info(product, item_url, position)
+            new_cards += 1
+        except Exception as e:
+            logger.warning("Error extracting basic details for product %s: %s", position, e, extra={"sample": "card_error"})
             try:
-                # First try to find the main product image on detail page
-                detail_img_selectors = [
-                    "//img[contains(@alt, 'hero')]",  # Specific selector from the example
-                    "//img[contains(@class, 'product-image')]",
-                    "//img[contains(@alt, 'product')]"
-                ]
-                
-                detail_img_element = None
-                
-                # Try each selector
-                for detail_selector in detail_img_selectors:
-                    detail_img_elements = driver.find_elements(By.XPATH, detail_selector)
-                    if detail_img_elements:
-                        detail_img_element = detail_img_elements[0]
-                        break
-                
-                if detail_img_element:
-                    # Get the highest quality image URL
-                    src_url = detail_img_element.get_attribute("src")
-                    srcset = detail_img_element.get_attribute("srcset")
-                    
-                    if srcset:  # Prefer srcset for highest resolution
-                        srcset_parts = srcset.split(',')
-                        if srcset_parts and len(srcset_parts) >= 4:  # If we have the 4x version
-                            # Get the last part which should be the highest resolution
-                            highest_res_part = srcset_parts[-1].strip()
-                            # Extract the URL part before any whitespace
-                            high_res_url = highest_res_part.split(' ')[0].strip()
-                            if high_res_url:
-                                product_info['image_url'] = high_res_url
-                        elif srcset_parts:  # If we have at least one part
-                            # Take the first part if we don't have multiple resolutions
-                            first_part = srcset_parts[0].strip()
-                            img_url = first_part.split(' ')[0].strip()
-                            if img_url:
-                                product_info['image_url'] = img_url
-                    elif src_url:  # Use src if srcset is not available
-                        product_info['image_url'] = src_url
-                        
-                    # Make sure we have a clean URL without truncation issues
-                    if product_info['image_url'] and product_info['image_url'].endswith(","):
-                        product_info['image_url'] = product_info['image_url'][:-1]
+                driver.execute_script(CARD_FORGET_SCRIPT, href)
+            except Exception:
+                pass
+    
+    if new_cards:
+        logger.info("Harvested %d new products (%d total)", new_cards, len(harvested), extra={"sample": "cards_harvested"})
+    return card_selector
+
+# Query parameters tried, in order, to find a paginated variant of a collection page
+PAGINATION_PARAMS = ("page", "offset")
+MAX_LISTING_PAGES = 100
+# A "page 2" sharing more of its products with page 1 is the same listing loaded again
+MAX_PAGE_OVERLAP = 0.2
+
+def listing_page_url(category_url, param, value):
+    """Return the collection URL with a page or offset query parameter set."""
+    parts = urllib.parse.urlsplit(category_url)
+    query = dict(urllib.parse.parse_qsl(parts.query))
+    query[param] = str(value)
+    return urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+def harvest_loaded_page(driver, harvested, card_selector, selector_stats, archive, record_url, page_urls=None):
+    """Harvest the cards of the current tab, then once more after scrolling to the bottom."""
+    card_selector = harvest_cards(driver, harvested, card_selector, selector_stats, archive, record_url, page_urls)
+    driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+    pause(driver, 2)
+    return harvest_cards(driver, harvested, card_selector, selector_stats, archive, record_url, page_urls)
+
+def harvest_pages_in_tabs(driver, urls, param, harvested, card_selector, selector_stats=None, archive=None,
+                          record_url=None, load_wait=10):
+    """Load listing pages side by side in new tabs and harvest them in page order.
+
+    All tabs are opened at once so the browser loads them concurrently.
+    Returns the number of new products found on each page (0 for a page whose
+    URL lost its page parameter, i.e. was redirected), the number of products
+    on each page (new or not) and the card selector.
+    """
+    main_handle = driver.current_window_handle
+    before = set(driver.window_handles)
+    for url in urls:
+        driver.execute_script("window.open(arguments[0], '_blank');", url)
+    handles = [handle for handle in driver.window_handles if handle not in before]
+    pause(driver, load_wait)
+    
+    wanted = [dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query)).get(param) for url in urls]
+    new_counts = [0] * len(urls)
+    card_counts = [0] * len(urls)
+    try:
+        # Tabs may not be listed in the order they were opened, so match them by URL
+        pages = []
+        for handle in handles:
+            driver.switch_to.window(handle)
+            value = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(driver.current_url).query)).get(param)
+            if value in wanted:
+                pages.append((wanted.index(value), handle))
+        for index, handle in sorted(pages):
+            driver.switch_to.window(handle)
+            handle_popups(driver)
+            before_count = len(harvested)
+            page_urls = set()
+            card_selector = harvest_loaded_page(driver, harvested, card_selector, selector_stats, archive, record_url,
+                                                page_urls)
+            new_counts[index] = len(harvested) - before_count
+            card_counts[index] = len(page_urls)
+    finally:
+        for handle in handles:
+            try:
+                driver.switch_to.window(handle)
+                driver.close()
             except Exception as e:
-                print(f"Error updating image URL from detail page: {e}")
-                # Keep the original image URL
+                logger.warning("Could not close listing tab: %s", e)
+        driver.switch_to.window(main_handle)
+    return new_counts, card_counts, card_selector
+
+def harvest_listing_pages(driver, category_url, harvested, card_selector, selector_stats=None, archive=None, tabs=4,
+                          deadline=None):
+    """Harvest the remaining pages of a paginated collection, several at a time.
+
+    harvested must hold the cards of the first page. Each parameter in
+    PAGINATION_PARAMS is tried with a single page first; unless that page
+    has products and shares less than MAX_PAGE_OVERLAP of them with page 1,
+    the collection isn't paginated that way. Pages are then fetched `tabs`
+    at a time until one comes back without new products, which must be
+    because it is empty: a page that only repeats products already seen
+    means the parameter is ignored (and a fresh load just mounted different
+    cards). Offsets step by the number of products on page 1; if a page
+    short of that is followed by more products, that page size was wrong.
+    No more pages are opened once the deadline (a time.time() value) has
+    passed. Returns True if pagination worked, False to fall back to
+    scrolling.
+    """
+    page_size = len(harvested)
+    if not page_size:
+        return False
+    
+    for param in PAGINATION_PARAMS:
+        if param == "page":
+            page_value = lambda page: page
+        else:
+            page_value = lambda page: (page - 1) * page_size
+            logger.info("Trying offsets in steps of %s products (the size of page 1)", page_size)
+        next_page = 2
+        batch_size = 1  # Probe with one page before opening several tabs
+        short_page_seen = False
+        paginated = False
+        while next_page <= MAX_LISTING_PAGES:
+            if deadline is not None and time.time() >= deadline:
+                logger.warning("Time budget used up, stopping before listing page %s", next_page)
+                # Scrolling stops at the deadline too, so there is nothing to fall back to
+                return True
+            pages = range(next_page, min(next_page + batch_size, MAX_LISTING_PAGES + 1))
+            urls = [listing_page_url(category_url, param, page_value(page)) for page in pages]
+            new_counts, card_counts, card_selector = harvest_pages_in_tabs(driver, urls, param, harvested, card_selector,
+                                                                           selector_stats, archive, category_url)
+            logger.info("Pages %s-%s (%s=): %s new products", pages[0], pages[-1], param, sum(new_counts))
             
-            # Add the complete product information to our final list
-            items.append({
-                "name": product_info['name'],
-                "id": item_id,
-                "url": product_info['url'],
-                "image_url": product_info['image_url'],
-                "price": product_info['price']
-            })
+            if next_page == 2:
+                shared = card_counts[0] - new_counts[0]
+                if not card_counts[0] or shared / card_counts[0] >= MAX_PAGE_OVERLAP:
+                    logger.info("Page 2 (%s=) repeats %s of its %s products from page 1, not paginated that way",
+                                param, shared, card_counts[0])
+                    break
             
-            print(f"Added product with ID {item_id}: {product_info['name']} - {product_info['price']}")
-            print(f"Image URL: {product_info['image_url']}")
+            if param == "offset":
+                consistent = True
+                for cards, new in zip(card_counts, new_counts):
+                    if short_page_seen and new:
+                        consistent = False
+                    short_page_seen = short_page_seen or cards < page_size
+                if not consistent:
+                    logger.warning("Offset pages don't hold the %s products of page 1, not paginated that way", page_size)
+                    break
             
-        except Exception as e:
-            print(f"Error processing product detail page {i+1}: {e}")
-            # Still add the product with the information we have
-            items.append({
-                "name": product_info['name'],
-                "id": f"error-{i+1}",
-                "url": product_info['url'],
-                "image_url": product_info['image_url'],
-                "price": product_info['price']
-            })
+            if 0 in new_counts:
+                last = new_counts.index(0)
+                paginated = not card_counts[last]
+                if not paginated:
+                    logger.warning("Page %s (%s=) only repeats products already seen, not paginated that way",
+                                   pages[last], param)
+                break
+            next_page += batch_size
+            batch_size = tabs
+        else:
+            paginated = True  # Stopped at MAX_LISTING_PAGES
+        
+        if paginated:
+            logger.info("Collection is paginated with '%s'", param)
+            return True
     
-    # Final deduplication step - ensure no duplicate product IDs
+    logger.info("No paginated variant of the collection found, falling back to scrolling")
+    return False
+
+@traced_step
+def scrape_listing_page(driver, category_url, display_name, selector_stats=None, archive=None, paginate=False,
+                        page_tabs=4, deadline=None):
+    """Load a collection page, scroll through it and return the products listed on it.
+
+    Cards are harvested after every scroll step, so products are kept even if
+    the page unmounts cards that have scrolled out of view. With a replay
+    archive, the recorded scroll steps are harvested instead. With paginate,
+    the collection's further pages are fetched in parallel tabs instead of
+    scrolling, if it has any. Scrolling stops early once the deadline (a
+    time.time() value) has passed.
+    """
+    from selenium.webdriver.common.by import By
+    
+    if archive is not None and archive.mode == "replay":
+        harvested = {}
+        card_selector = None
+        snapshots = archive.snapshots(category_url, "listing")
+        logger.info("Replaying %s recorded scroll steps of %s", len(snapshots), display_name)
+        for html in snapshots:
+            load_archived_page(driver, category_url, html)
+            card_selector = harvest_cards(driver, harvested, card_selector, selector_stats)
+        logger.info("Harvested %s unique products from the listing page", len(harvested))
+        return list(harvested.values())
+    
+    limit_page_load(driver, deadline)
+    driver.get(category_url)
+    logger.info("Navigated to %s URL: %s", display_name, category_url)
+    if not listing_resolves(driver, category_url):
+        raise CategoryUrlError(f"{category_url} no longer leads to the {display_name} collection (now at {driver.current_url})")
+    
+    # Save HTML for debugging
+    html_source = driver.page_source
+    with open(f"{display_name}_page_source.html", "w", encoding="utf-8") as f:
+        f.write(html_source)
+    logger.info("Saved page source to %s_page_source.html for debugging", display_name)
+    
+    # Handle any popups that might appear
+    handle_popups(driver)
+    
+    # Wait for page to fully load with a longer timeout
+    logger.info("Waiting for page to fully load...")
+    pause(driver, 10)
+    
+    # Take screenshot for debugging
+    driver.save_screenshot(f"{display_name}_page_loaded.png")
+    logger.info("Saved screenshot of %s page after loading", display_name)
+    
+    # Scroll to load all items (lazy loading)
+    logger.info("Scrolling to load all products...")
+    harvested = {}  # Product URL -> listing info, in the order the cards appeared
+    card_selector = harvest_cards(driver, harvested, None, selector_stats, archive, category_url)
+    if paginate:
+        card_selector = harvest_loaded_page(driver, harvested, card_selector, selector_stats, archive, category_url)
+        if harvest_listing_pages(driver, category_url, harvested, card_selector, selector_stats, archive, page_tabs,
+                                 deadline):
+            logger.info("Harvested %s unique products from the listing pages", len(harvested))
+            return list(harvested.values())
+    scroll_attempts = 0
+    max_scroll_attempts = 15  # Increased from 10 to allow more scrolling attempts
+    last_height = driver.execute_script("return document.body.scrollHeight")
+    
+    while scroll_attempts < max_scroll_attempts:
+        if deadline is not None and time.time() >= deadline:
+            logger.warning("Time budget used up, stopping scrolling")
+            break
+        
+        # Scroll down progressively (25% of viewport height at a time)
+        # This gives the page more time to load items as we scroll
+        current_height = driver.execute_script("return Math.max(document.documentElement.scrollTop, document.body.scrollTop);")
+        viewport_height = driver.execute_script("return window.innerHeight;")
+        next_scroll_position = min(current_height + viewport_height * 0.75, last_height)
+        
+        # Scroll to the next position
+        driver.execute_script(f"window.scrollTo(0, {next_scroll_position});")
+        logger.info("Scrolled down progressively (attempt %d)", scroll_attempts + 1, extra={"sample": "scroll_step"})
+        
+        # Wait for new items to load - increased from 3 to 5 seconds
+        pause(driver, 5)
+        
+        # Harvest the cards mounted right now, before they can be scrolled away
+        card_selector = harvest_cards(driver, harvested, card_selector, selector_stats, archive, category_url)
+        
+        # Calculate new scroll height and compare with last scroll height
+        new_height = driver.execute_script("return document.body.scrollHeight")
+        
+        # If we're at the bottom of the page or close to it
+        if current_height + viewport_height >= last_height * 0.95:
+            if new_height == last_height:
+                # Try once more before breaking
+                driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+                pause(driver, 5)  # Increased wait time
+                newer_height = driver.execute_script("return document.body.scrollHeight")
+                card_selector = harvest_cards(driver, harvested, card_selector, selector_stats, archive, category_url)
+                if newer_height == new_height:
+                    logger.info("Reached end of page after scrolling")
+                    break
+        
+        last_height = new_height
+        scroll_attempts += 1
+    
+    # Take a final screenshot after scrolling
+    driver.save_screenshot("after_scrolling.png")
+    
+    if not harvested:
+        logger.warning("Could not find any products with our selectors. Saving page for debugging.")
+        driver.save_screenshot("no_products_found.png")
+        
+        # Look for any links that might be products
+        logger.info("Looking for any links that might be products...")
+        links = driver.find_elements(By.TAG_NAME, "a")
+        product_links = [link for link in links if '/products/' in (link.get_attribute('href') or '')]
+        
+        if product_links:
+            logger.info("Found %s potential product links", len(product_links))
+            for link in product_links:
+                item_url = absolute_product_url(link.get_attribute("href"))
+                if item_url not in harvested:
+                    try:
+                        harvested[item_url] = extract_card_info(link, item_url, len(harvested) + 1)
+                    except Exception as e:
+                        logger.warning("Error extracting basic details for product %s: %s", len(harvested) + 1, e)
+        else:
+            logger.warning("No product links found at all.")
+            return []
+    
+    logger.info("Harvested %s unique products from the listing page", len(harvested))
+    return list(harvested.values())
+
+# Seconds kept free at the end of a time budget for saving the results
+TIME_BUDGET_RESERVE = 30
+# Rough seconds to start a browser and set its location, until one has been timed
+BROWSER_STARTUP_SECONDS = 60
+
+class ItemCostEstimate:
+    """Running estimate of the seconds one product page takes, from observed timings."""
+    
+    def __init__(self, initial=15.0, smoothing=0.3):
+        self.seconds = initial
+        self.smoothing = smoothing
+        self.observed = 0
+    
+    def observe(self, seconds):
+        if self.observed == 0:
+            self.seconds = seconds
+        else:
+            self.seconds += self.smoothing * (seconds - self.seconds)
+        self.observed += 1
+    
+    def fits(self, deadline, extra=0.0):
+        """Whether one more page (after waiting `extra` seconds) ends before the deadline."""
+        return deadline is None or time.time() + extra + self.seconds <= deadline
+
+def limit_page_load(driver, deadline):
+    """Cut page loads and scripts off at the deadline (a time.time() value), if there is one.
+
+    Otherwise a hung load keeps the crawl waiting for WebDriver's default
+    of 300 seconds, well past a time budget. The deadline already leaves
+    TIME_BUDGET_RESERVE free for saving, so the loads may use all of the
+    time up to it.
+    """
+    if deadline is None or driver is None:
+        return
+    seconds = max(1, deadline - time.time())
+    driver.set_page_load_timeout(seconds)
+    driver.set_script_timeout(seconds)
+
+def find_previous_output(category, zipcode, exclude=None):
+    """Return the most recent earlier crawl CSV of a category and zip code, if any."""
+    candidates = [path for path in glob.glob(f"costco_{category}_items_{zipcode}_*.csv")
+                  if not path.endswith("_failures.csv") and os.path.abspath(path) != os.path.abspath(exclude or "")]
+    # Dates in the names are YYYY-MM-DD, so the last name is the latest crawl
+    return max(candidates) if candidates else None
+
+def load_previous_prices(filename):
+    """Read product URL -> price from an earlier crawl CSV (empty if there is none)."""
+    if not filename or not os.path.exists(filename):
+        return {}
+    with open(filename, 'r', newline='', encoding='utf-8') as csvfile:
+        return {row['url']: row['price'] for row in csv.DictReader(csvfile)}
+
+def prioritize_products(product_list, previous_prices):
+    """Order products so the most valuable pages are visited first under a time budget.
+
+    New products come first, then products whose listing price changed since
+    the previous crawl, then the rest; each group keeps page order.
+    """
+    def priority(product_info):
+        previous_price = previous_prices.get(product_info['url'])
+        if previous_price is None:
+            group = 0
+        elif product_info['price'] and product_info['price'] != previous_price:
+            group = 1
+        else:
+            group = 2
+        return group, product_info.get('page_position') or 0
+    ordered = sorted(product_list, key=priority)
+    new_count = sum(1 for p in product_list if p['url'] not in previous_prices)
+    logger.info("Visiting %s new products first (of %s)", new_count, len(product_list))
+    return ordered
+
+def skipped_record(product_info, category, reason="Skipped: time budget exhausted"):
+    """Build the failure report row for a product page that was never visited."""
+    return {
+        "category": category,
+        "name": product_info['name'],
+        "url": product_info['url'],
+        "page_position": product_info.get('page_position'),
+        "attempts": 0,
+        "error": reason
+    }
+
+def write_crawl_status(filename, complete, items, failed_pages, skipped_pages, reason=None):
+    """Write the <output>_status.json flag telling whether a crawl's CSV is complete."""
+    status_filename = f"{os.path.splitext(filename)[0]}_status.json"
+    with open(status_filename, 'w', encoding='utf-8') as f:
+        json.dump({
+            "output": filename,
+            "complete": complete,
+            "reason": reason,
+            "items": items,
+            "failed_pages": failed_pages,
+            "skipped_pages": skipped_pages,
+            "finished_at": datetime.datetime.now().isoformat(timespec='seconds')
+        }, f, indent=2)
+    logger.info("Crawl status saved to %s", status_filename)
+
+def deduplicate_items(items):
+    """Final deduplication step - ensure no duplicate product IDs."""
     deduplicated_items = []
     seen_ids = set()
     
-    for item in items:
-        # If we've seen this ID before, skip it
-        if item['id'] in seen_ids:
-            print(f"Removing duplicate product with ID: {item['id']}, name: {item['name']}")
-            continue
+    for item in items:
+        # If we've seen this ID before, skip it
+        if item['id'] in seen_ids:
+            logger.info("Removing duplicate product with ID: %s, name: %s", item['id'], item['name'], extra={"sample": "duplicate_removed"})
+            continue
+        
+        # Otherwise, add it to our deduplicated list and track the ID
+        seen_ids.add(item['id'])
+        deduplicated_items.append(item)
+    
+    if len(items) != len(deduplicated_items):
+        logger.info("Removed %s duplicate products by ID", len(items) - len(deduplicated_items))
+    return deduplicated_items
+
+def scrape_items(driver, category="produce", max_items=None, max_attempts=3, driver_factory=None, failures=None,
+                 selector_stats=None, product_urls=None, archive=None, watchdog=None, category_map=None,
+                 paginate=False, page_tabs=4, deadline=None, previous_prices=None, skipped=None,
+                 parse_workers=0, hedger=None):
+    """Scrape all items from the specified category page.
+
+    Product pages that fail are retried with backoff up to max_attempts times
+    in total (on a fresh driver from driver_factory, if given). Pages that
+    still fail are left out of the results and appended to the failures list.
+    If selector_stats is given, selector chains are tried in order of past
+    success and the stats are updated with this run's hits and misses.
+    If product_urls is given (e.g. from the sitemap), those product pages are
+    visited directly instead of scrolling the category page; category may
+    then be None, as the sitemap doesn't say which category a product is in.
+    With a PageArchive in record mode every fetched page is stored; in replay
+    mode pages are read from the archive instead of the live site, and
+    product pages are parsed offline (the browser only replays listings).
+    With a DriverWatchdog the browser may be swapped for a fresh one between
+    product pages; use watchdog.driver afterwards.
+    With a CategoryMap the category URL is looked up there, and the map is
+    rediscovered from the site if the URL no longer resolves.
+    With paginate, the listing is read from its numbered pages in parallel
+    tabs (page_tabs at a time) when the collection has them.
+    With a deadline (a time.time() value), product pages are visited in
+    priority order against previous_prices and the crawl stops before a page
+    that would not finish in time; the pages left out are appended to the
+    skipped list as report rows. Page loads are cut off at the deadline, and
+    a page whose load ran into it is skipped too.
+    With parse_workers, the browser only captures each product page's HTML
+    and moves on, while a pool of that many processes extracts the details.
+    With a PageHedger, slow product page loads are raced against its spare
+    browser; the browser that wins becomes watchdog.driver.
+    """
+    if archive is not None and archive.mode == "replay":
+        # Recorded pages don't load slowly
+        hedger = None
+    
+    if archive is not None and archive.mode == "replay" and product_urls is None:
+        # The recorded crawl may have visited product pages without a listing page
+        category_info, product_urls = recorded_category(archive, category, category_map)
+    elif category is None and product_urls is not None:
+        category_info = {"url": None, "display_name": "sitemap"}
+    elif category_map is not None:
+        category_info = category_map.get(category, driver)
+    else:
+        category_info = get_category_info(category)
+    category_url = category_info["url"]
+    display_name = category_info["display_name"]
+    
+    if archive is not None and archive.mode == "record":
+        # Sitemap crawls are replayed with --category sitemap
+        archive.category = category.lower() if category is not None else "sitemap"
+    
+    if product_urls is not None:
+        # Discovery already produced the product URLs, so skip the listing page
+        product_list = products_from_urls(product_urls)
+        logger.info("Using %s product URLs from discovery for %s", len(product_list), display_name)
+    else:
+        try:
+            product_list = scrape_listing_page(driver, category_url, display_name, selector_stats, archive,
+                                               paginate, page_tabs, deadline)
+        except CategoryUrlError as e:
+            if category_map is None:
+                raise
+            category_url = category_map.rediscover_url(category, category_url, driver, e)
+            product_list = scrape_listing_page(driver, category_url, display_name, selector_stats, archive,
+                                               paginate, page_tabs, deadline)
+    
+    # If max_items is set, limit the number of products to process
+    if max_items and max_items > 0 and len(product_list) > max_items:
+        logger.info("Limiting to %s products for testing (out of %s found)", max_items, len(product_list))
+        product_list = product_list[:max_items]
+    
+    if deadline is not None:
+        product_list = prioritize_products(product_list, previous_prices or {})
+    
+    # Now navigate to each product page to get the actual Costco item ID
+    items = []
+    retry_queue = []
+    item_cost = ItemCostEstimate()
+    
+    def add_item(item):
+        items.append(item)
+        logger.info("Added product with ID %s: %s - %s", item['id'], item['name'], item['price'], extra={"sample": "product_added"})
+        logger.info("Image URL: %s", item['image_url'], extra={"sample": "product_image"})
+    
+    def queue_retry(product_info, position, e):
+        logger.warning("Error processing product detail page %s: %s", position, e)
+        # Queue the page for a retry at the end of the crawl
+        error_text = str(e).strip()
+        retry_queue.append({
+            "product_info": product_info,
+            "position": position,
+            "attempts": 1,
+            "last_error": error_text.splitlines()[0] if error_text else repr(e)
+        })
+    
+    # Pipelined mode: pages captured by the browser but not parsed yet, oldest first
+    parse_pool = concurrent.futures.ProcessPoolExecutor(max_workers=parse_workers) if parse_workers else None
+    in_flight = collections.deque()
+    
+    def finish_oldest_parse():
+        position, product_info, id_selectors, img_selectors, future = in_flight.popleft()
+        try:
+            details = future.result()
+            record_chain_result(selector_stats, "item_id", id_selectors, details.get('id_selector_index', -1))
+            record_chain_result(selector_stats, "detail_image", img_selectors, details.get('img_selector_index', -1))
+            add_item(complete_product(product_info, details, position))
+        except Exception as e:
+            queue_retry(product_info, position, e)
+    
+    try:
+        for i, product_info in enumerate(product_list):
+            if not item_cost.fits(deadline):
+                logger.warning("Time budget nearly used up, skipping the last %s product pages", len(product_list) - i)
+                if skipped is not None:
+                    skipped.extend(skipped_record(p, display_name) for p in product_list[i:])
+                break
+            if watchdog is not None:
+                driver = watchdog.checkpoint()
+            limit_page_load(driver, deadline)
+            page_started = time.time()
+            try:
+                logger.info("Visiting product page %d/%d: %s", i+1, len(product_list), product_info['name'] or product_info['url'], extra={"sample": "product_visit"})
+                logger.info("URL: %s", product_info['url'], extra={"sample": "product_url"})
+                
+                if hedger is not None:
+                    # The spare browser comes back if it loaded the page first
+                    driver = hedger.open(driver, product_info, archive, deadline)
+                    if watchdog is not None:
+                        watchdog.driver = driver
+                
+                if parse_pool is None and hedger is None:
+                    add_item(scrape_product_page(driver, product_info, i+1, selector_stats, archive))
+                elif parse_pool is None:
+                    details = extract_product_details(driver, selector_stats)
+                    add_item(complete_product(ProductRecord.from_mapping(product_info), details, i+1))
+                else:
+                    # Hand the HTML to a parse worker and go straight on to the next page
+                    if hedger is not None:
+                        html = driver.page_source
+                    else:
+                        html = open_product_page(driver, product_info, archive, capture=True)
+                    id_selectors = order_selectors(selector_stats, "item_id", ID_SELECTORS)
+                    img_selectors = order_selectors(selector_stats, "detail_image", DETAIL_IMG_SELECTORS)
+                    future = parse_pool.submit(parse_product_html, html, product_info['url'], id_selectors, img_selectors)
+                    in_flight.append((i+1, product_info, id_selectors, img_selectors, future))
+                    # Keep a bounded number of captured pages in memory
+                    while len(in_flight) > parse_workers * 4 or (in_flight and in_flight[0][-1].done()):
+                        finish_oldest_parse()
+            except Exception as e:
+                if deadline is not None and time.time() >= deadline:
+                    # The load was cut off by the time budget, not by a broken page
+                    logger.warning("Time budget used up loading %s, skipping the last %s product pages",
+                                   product_info['url'], len(product_list) - i)
+                    if skipped is not None:
+                        skipped.extend(skipped_record(p, display_name) for p in product_list[i:])
+                    break
+                queue_retry(product_info, i+1, e)
+            item_cost.observe(time.time() - page_started)
         
-        # Otherwise, add it to our deduplicated list and track the ID
-        seen_ids.add(item['id'])
-        deduplicated_items.append(item)
+        while in_flight:
+            finish_oldest_parse()
+    finally:
+        if parse_pool is not None:
+            parse_pool.shutdown()
     
-    if len(items) != len(deduplicated_items):
-        print(f"Removed {len(items) - len(deduplicated_items)} duplicate products by ID")
+    # Retry failed pages with backoff, and report the ones that never succeeded
+    if retry_queue:
+        if max_attempts > 1:
+            retried_items, failed_pages = retry_failed_pages(
+                driver, retry_queue, display_name,
+                max_attempts=max_attempts, driver_factory=driver_factory,
+                selector_stats=selector_stats, archive=archive, watchdog=watchdog,
+                deadline=deadline, item_cost=item_cost)
+            items.extend(retried_items)
+        else:
+            failed_pages = [failure_record(entry, display_name) for entry in retry_queue]
+        
+        if failed_pages:
+            logger.warning("%s product pages in %s could not be scraped", len(failed_pages), display_name)
+        if failures is not None:
+            failures.extend(failed_pages)
     
-    print(f"Successfully processed {len(deduplicated_items)} unique products")
+    deduplicated_items = deduplicate_items(items)
+    logger.info("Successfully processed %s unique products", len(deduplicated_items))
     return deduplicated_items
 
+ITEM_CSV_FIELDS = ["name", "id", "url", "image_url", "price"]
+FAILURE_CSV_FIELDS = ["category", "name", "url", "page_position", "attempts", "error"]
+
 def save_to_csv(items, category="produce", filename=None):
     """Save the scraped items to a CSV file."""
     if filename is None:
         filename = f"costco_{category}_items.csv"
     
-    fieldnames = ["name", "id", "url", "image_url", "price"]
-    
     with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=ITEM_CSV_FIELDS)
         writer.writeheader()
         writer.writerows(items)
     
-    print(f"Data saved to {filename}")
-    print(f"Total unique items: {len(items)}")
+    logger.info("Data saved to %s", filename)
+    logger.info("Total unique items: %s", len(items))
 
-def main():
-    # Parse command line arguments
-    parser = argparse.ArgumentParser(description='Costco Sameday Crawler')
-    parser.add_argument('--visible', action='store_true', help='Run in visible mode (not headless)')
-    parser.add_argument('--zipcode', type=str, default='94107', help='ZIP code for delivery location')
-    parser.add_argument('--output', type=str, default=None, help='Output CSV filename')
-    parser.add_argument('--max', type=int, default=0, help='Maximum number of items to crawl (for testing, 0 = no limit)')
-    parser.add_argument('--category', type=str, default='produce', help='Category to crawl (e.g., produce, bakery)')
-    args = parser.parse_args()
-    
-    # Generate filename with category, zipcode and date
+def save_failures_to_csv(failures, filename):
+    """Save the product pages that could not be scraped to a CSV file."""
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=FAILURE_CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(failures)
+    
+    logger.info("Failed product pages saved to %s", filename)
+    
+    # Summarize failures per category
+    failures_by_category = {}
+    for failure in failures:
+        failures_by_category[failure['category']] = failures_by_category.get(failure['category'], 0) + 1
+    for category, count in failures_by_category.items():
+        logger.info("  %s: %s failed product pages", category, count)
+
+class WorkQueue(abc.ABC):
+    """Interface for the shared task store used to spread a crawl over workers.
+
+    A task is a dict with kind ("category", "listing" or "detail"), a key that
+    is unique within the job, and a JSON-serializable payload. Implementations
+    must make lease() atomic across processes and hosts, and only accept
+    complete() or fail() from the worker that still holds the lease, so every
+    task is finished exactly once.
+    """
+    
+    @abc.abstractmethod
+    def add_tasks(self, job, tasks):
+        """Add tasks to a job, ignoring tasks whose key already exists."""
+    
+    @abc.abstractmethod
+    def lease(self, job, worker_id, lease_seconds, max_attempts=3):
+        """Lease the next available task of a job, or return None.
+
+        A task whose lease expired max_attempts times (its worker keeps dying
+        on it) is marked failed instead of being leased again.
+        """
+    
+    @abc.abstractmethod
+    def complete(self, task, result=None, new_tasks=()):
+        """Store a task's result and add its follow-up tasks in one step.
+
+        Returns False if the lease was lost and the result was discarded.
+        """
+    
+    @abc.abstractmethod
+    def fail(self, task, error, max_attempts=3):
+        """Release a failed task for a later retry, or mark it failed for good."""
+    
+    @abc.abstractmethod
+    def is_finished(self, job):
+        """Return True when no task of the job is pending or leased."""
+    
+    @abc.abstractmethod
+    def iter_finished_tasks(self, job):
+        """Yield the done and failed tasks of a job, with results and errors, one at a time."""
+    
+    def finished_tasks(self, job):
+        """Return all done and failed tasks of a job as a list."""
+        return list(self.iter_finished_tasks(job))
+
+class SQLiteWorkQueue(WorkQueue):
+    """Work queue stored in a SQLite file, shared by processes on one host."""
+    
+    # Finish products before expanding more listing pages
+    KIND_PRIORITY = {"detail": 0, "listing": 1, "category": 2}
+    
+    def __init__(self, path):
+        self.path = path
+        # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                task_key TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_token TEXT,
+                lease_expires REAL,
+                result TEXT,
+                error TEXT,
+                UNIQUE (job, task_key)
+            )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS tasks_by_status ON tasks (job, status, priority, available_at)")
+    
+    def _insert_tasks(self, job, tasks):
+        for task in tasks:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO tasks (job, kind, task_key, priority, payload) VALUES (?, ?, ?, ?, ?)",
+                (job, task['kind'], task['key'], self.KIND_PRIORITY.get(task['kind'], 9), json.dumps(task['payload'], default=record_to_json)))
+    
+    def add_tasks(self, job, tasks):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._insert_tasks(job, tasks)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+    
+    def lease(self, job, worker_id, lease_seconds, max_attempts=3):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            # A worker that never came back with the last attempt counts as a failure
+            self.conn.execute("""
+                UPDATE tasks SET status = 'failed', lease_token = NULL,
+                                 error = 'Lease expired ' || attempts || ' times (the worker stopped responding)'
+                WHERE job = ? AND status = 'leased' AND lease_expires < ? AND attempts >= ?""",
+                (job, now, max_attempts))
+            
+            # Pending tasks whose backoff has passed, or leases that have expired
+            row = self.conn.execute("""
+                SELECT * FROM tasks
+                WHERE job = ? AND ((status = 'pending' AND available_at <= ?)
+                                   OR (status = 'leased' AND lease_expires < ?))
+                ORDER BY priority, id LIMIT 1""", (job, now, now)).fetchone()
+            if row is None:
+                self.conn.execute("COMMIT")
+                return None
+            token = uuid.uuid4().hex
+            self.conn.execute("""
+                UPDATE tasks SET status = 'leased', lease_owner = ?, lease_token = ?,
+                                 lease_expires = ?, attempts = attempts + 1
+                WHERE id = ?""", (worker_id, token, now + lease_seconds, row['id']))
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        
+        return {
+            "id": row['id'],
+            "job": row['job'],
+            "kind": row['kind'],
+            "key": row['task_key'],
+            "payload": json.loads(row['payload']),
+            "attempts": row['attempts'] + 1,
+            "lease_token": token
+        }
+    
+    def complete(self, task, result=None, new_tasks=()):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = self.conn.execute("""
+                UPDATE tasks SET status = 'done', result = ?, error = NULL, lease_token = NULL
+                WHERE id = ? AND status = 'leased' AND lease_token = ?""",
+                (json.dumps(result, default=record_to_json), task['id'], task['lease_token'])).rowcount
+            if updated:
+                self._insert_tasks(task['job'], new_tasks)
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return bool(updated)
+    
+    def fail(self, task, error, max_attempts=3):
+        if task['attempts'] >= max_attempts:
+            status, available_at = 'failed', 0
+        else:
+            status, available_at = 'pending', time.time() + retry_delay(task['attempts'])
+        self.conn.execute("""
+            UPDATE tasks SET status = ?, available_at = ?, error = ?, lease_token = NULL
+            WHERE id = ? AND status = 'leased' AND lease_token = ?""",
+            (status, available_at, error, task['id'], task['lease_token']))
+    
+    def is_finished(self, job):
+        row = self.conn.execute(
+            "SELECT COUNT(*) FROM tasks WHERE job = ? AND status IN ('pending', 'leased')", (job,)).fetchone()
+        return row[0] == 0
+    
+    def iter_finished_tasks(self, job):
+        # Rows are read from the cursor as they are needed, never the whole job at once
+        for row in self.conn.execute(
+                "SELECT * FROM tasks WHERE job = ? AND status IN ('done', 'failed') ORDER BY id", (job,)):
+            yield {
+                "kind": row['kind'],
+                "key": row['task_key'],
+                "payload": json.loads(row['payload']),
+                "status": row['status'],
+                "attempts": row['attempts'],
+                "result": json.loads(row['result']) if row['result'] else None,
+                "error": row['error']
+            }
+
+def open_work_queue(location):
+    """Open the work queue at a location such as jobs.db or sqlite:///jobs.db."""
+    if location.startswith("sqlite:///"):
+        return SQLiteWorkQueue(location[len("sqlite:///"):])
+    if "://" in location:
+        raise ValueError(f"Unsupported work queue: {location}")
+    return SQLiteWorkQueue(location)
+
+def enqueue_crawl(work_queue, job, categories, zipcodes, max_items=None):
+    """Add a category task for every category and zip code combination."""
+    tasks = [{
+        "kind": "category",
+        "key": f"category:{zipcode}:{category}",
+        "payload": {"category": category, "zipcode": zipcode, "max_items": max_items}
+    } for zipcode in zipcodes for category in categories]
+    work_queue.add_tasks(job, tasks)
+    logger.info("Queued %s category tasks for job %s", len(tasks), job)
+
+def run_worker(work_queue, job="default", headless=True, max_attempts=3, lease_seconds=900,
+               selector_stats=None, poll_interval=5, browser_cache=None, category_map=None):
+    """Lease and run tasks from the work queue until the job is finished.
+
+    Category tasks expand into listing tasks, listing tasks scroll a category
+    page and expand into detail tasks, and detail tasks scrape one product
+    page and store the item as their result. Category names are looked up in
+    category_map (the built-in categories if None); unknown categories fail
+    without retries.
+    """
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    logger.info("Worker %s starting on job %s", worker_id, job)
+    if category_map is None:
+        category_map = CategoryMap(cache_file=None)
+    driver = None
+    current_zipcode = None
+    completed = 0
+    
+    def located_driver(zipcode):
+        """Return the worker's browser located at zipcode, starting it if needed."""
+        nonlocal driver, current_zipcode
+        if driver is None:
+            driver = start_session(headless=headless, zipcode=zipcode, browser_cache=browser_cache)
+            if driver is None:
+                raise RuntimeError(f"Failed to set location to {zipcode}")
+        elif current_zipcode != zipcode:
+            if not set_location(driver, zipcode=zipcode):
+                raise RuntimeError(f"Failed to set location to {zipcode}")
+        current_zipcode = zipcode
+        return driver
+    
+    try:
+        while True:
+            task = work_queue.lease(job, worker_id, lease_seconds, max_attempts)
+            if task is None:
+                if work_queue.is_finished(job):
+                    break
+                # Other workers still hold leases that may expire and come back
+                time.sleep(poll_interval)
+                continue
+            
+            payload = task['payload']
+            logger.info("Leased %s task %s (attempt %d)", task['kind'], task['key'], task['attempts'], extra={"sample": "task_leased"})
+            result = None
+            new_tasks = []
+            try:
+                if task['kind'] == "category":
+                    # Only start a browser to look for a category the map doesn't know yet
+                    lookup_driver = None
+                    if payload['category'].lower() not in category_map.categories and category_map.expired():
+                        lookup_driver = located_driver(payload['zipcode'])
+                    category_info = category_map.get(payload['category'], lookup_driver)
+                    new_tasks.append({
+                        "kind": "listing",
+                        "key": f"listing:{payload['zipcode']}:{category_info['url']}",
+                        "payload": dict(payload, category=category_info['display_name'], url=category_info['url'],
+                                        category_name=payload['category'])
+                    })
+                else:
+                    # Browser tasks need a driver located at the task's zip code
+                    located_driver(payload['zipcode'])
+                    
+                    if task['kind'] == "listing":
+                        try:
+                            product_list = scrape_listing_page(driver, payload['url'], payload['category'], selector_stats)
+                        except CategoryUrlError as e:
+                            if 'category_name' not in payload:
+                                raise
+                            url = category_map.rediscover_url(payload['category_name'], payload['url'], driver, e)
+                            product_list = scrape_listing_page(driver, url, payload['category'], selector_stats)
+                        if payload.get('max_items'):
+                            product_list = product_list[:payload['max_items']]
+                        new_tasks = [{
+                            "kind": "detail",
+                            "key": f"detail:{payload['zipcode']}:{product_info['url']}",
+                            "payload": {
+                                "category": payload['category'],
+                                "zipcode": payload['zipcode'],
+                                "product_info": product_info,
+                                "position": i+1
+                            }
+                        } for i, product_info in enumerate(product_list)]
+                    elif task['kind'] == "detail":
+                        result = scrape_product_page(driver, payload['product_info'], payload['position'], selector_stats)
+                        logger.info("Added product with ID %s: %s - %s", result['id'], result['name'], result['price'], extra={"sample": "product_added"})
+                    else:
+                        raise ValueError(f"Unknown task kind: {task['kind']}")
+                
+                if work_queue.complete(task, result, new_tasks):
+                    completed += 1
+                else:
+                    logger.warning("Lease on %s expired, result discarded", task['key'])
+            except CategoryUrlError as e:
+                # A retry would look up the same map, so report the task failed right away
+                logger.warning("Error running task %s: %s", task['key'], e)
+                work_queue.fail(task, str(e), max_attempts=0)
+            except Exception as e:
+                error_text = str(e).strip()
+                error = error_text.splitlines()[0] if error_text else repr(e)
+                logger.warning("Error running task %s: %s", task['key'], error)
+                work_queue.fail(task, error, max_attempts)
+                # The browser may have died with the task, so the next browser task starts a fresh one
+                if driver is not None:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+                    driver = None
+                    current_zipcode = None
+    finally:
+        if driver is not None:
+            driver.quit()
+    
+    logger.info("Worker %s finished after completing %s tasks", worker_id, completed)
+
+def export_queue_results(work_queue, job="default"):
+    """Write the items and failures of a finished job to CSV files per category and zip code.
+
+    Tasks are streamed from the queue and every row goes straight to its
+    file, so only the item IDs seen so far (for deduplication) are kept in
+    memory, however large the job.
+    """
     today_date = datetime.datetime.now().strftime('%Y-%m-%d')
-    if args.output is None:  # Only use auto-generated filename if no output specified
-        filename = f"costco_{args.category}_items_{args.zipcode}_{today_date}.csv"
+    files = []
+    item_writers = {}  # (category, zipcode) -> [csv writer, filename, item IDs seen]
+    failure_writers = {}  # (category, zipcode) -> [csv writer, filename]
+    failures_by_category = {}
+    
+    def open_writer(filename, fieldnames):
+        csvfile = open(filename, 'w', newline='', encoding='utf-8')
+        files.append(csvfile)
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        return writer
+    
+    try:
+        for task in work_queue.iter_finished_tasks(job):
+            payload = task['payload']
+            group = (payload['category'], payload['zipcode'])
+            filename = f"costco_{payload['category']}_items_{payload['zipcode']}_{today_date}.csv"
+            if task['status'] == "done" and task['kind'] == "detail":
+                if group not in item_writers:
+                    item_writers[group] = [open_writer(filename, ITEM_CSV_FIELDS), filename, set()]
+                writer, _, seen_ids = item_writers[group]
+                item = ProductRecord.from_mapping(task['result'])
+                if item['id'] in seen_ids:
+                    logger.info("Removing duplicate product with ID: %s, name: %s", item['id'], item['name'], extra={"sample": "duplicate_removed"})
+                    continue
+                seen_ids.add(item['id'])
+                writer.writerow(item)
+            elif task['status'] == "failed":
+                if group not in failure_writers:
+                    failures_filename = f"{os.path.splitext(filename)[0]}_failures.csv"
+                    failure_writers[group] = [open_writer(failures_filename, FAILURE_CSV_FIELDS), failures_filename]
+                product_info = payload.get('product_info', {})
+                failure_writers[group][0].writerow({
+                    "category": payload['category'],
+                    "name": product_info.get('name'),
+                    "url": product_info.get('url', payload.get('url')),
+                    "page_position": payload.get('position'),
+                    "attempts": task['attempts'],
+                    "error": task['error']
+                })
+                failures_by_category[payload['category']] = failures_by_category.get(payload['category'], 0) + 1
+    finally:
+        for csvfile in files:
+            csvfile.close()
+    
+    for _, filename, seen_ids in item_writers.values():
+        logger.info("Data saved to %s", filename)
+        logger.info("Total unique items: %s", len(seen_ids))
+    for _, filename in failure_writers.values():
+        logger.info("Failed product pages saved to %s", filename)
+    for category, count in failures_by_category.items():
+        logger.info("  %s: %s failed product pages", category, count)
+    
+    if not item_writers:
+        logger.warning("No finished items in job %s", job)
+
+class BrowserPool:
+    """Pool of warm browsers that already have their delivery location set, per zip code."""
+    
+    def __init__(self, headless=True, size_per_zipcode=1, browser_cache=None):
+        self.headless = headless
+        self.size_per_zipcode = size_per_zipcode
+        self.browser_cache = browser_cache
+        self.idle = {}  # zipcode -> list of idle drivers
+        self.counts = {}  # zipcode -> number of drivers started (idle or in use)
+        self.condition = threading.Condition()
+    
+    def warm(self, zipcodes):
+        """Start and locate the browsers for the given zip codes up front."""
+        for zipcode in zipcodes:
+            for _ in range(self.size_per_zipcode):
+                driver = self._start(zipcode)
+                if driver is not None:
+                    self.release(zipcode, driver)
+    
+    def _start(self, zipcode):
+        with self.condition:
+            self.counts[zipcode] = self.counts.get(zipcode, 0) + 1
+        logger.info("Starting browser for zipcode %s", zipcode)
+        try:
+            driver = start_session(headless=self.headless, zipcode=zipcode, browser_cache=self.browser_cache)
+        except Exception as e:
+            logger.error("Error starting browser for zipcode %s: %s", zipcode, e)
+            driver = None
+        if driver is None:
+            with self.condition:
+                self.counts[zipcode] -= 1
+                self.condition.notify_all()
+        return driver
+    
+    def acquire(self, zipcode, timeout=300):
+        """Take an idle browser for the zip code, starting one if the pool has room."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                if self.idle.get(zipcode):
+                    return self.idle[zipcode].pop()
+                if self.counts.get(zipcode, 0) < self.size_per_zipcode:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise TimeoutError(f"No browser available for zipcode {zipcode}")
+                self.condition.wait(remaining)
+        driver = self._start(zipcode)
+        if driver is None:
+            raise RuntimeError(f"Failed to set location to {zipcode}")
+        return driver
+    
+    def release(self, zipcode, driver):
+        """Return a healthy browser to the pool."""
+        with self.condition:
+            self.idle.setdefault(zipcode, []).append(driver)
+            self.condition.notify_all()
+    
+    def discard(self, zipcode, driver):
+        """Quit a browser that failed, so the next request gets a fresh one."""
+        try:
+            driver.quit()
+        except Exception:
+            pass
+        with self.condition:
+            self.counts[zipcode] -= 1
+            self.condition.notify_all()
+    
+    def close(self):
+        """Quit every idle browser."""
+        with self.condition:
+            for drivers in self.idle.values():
+                for driver in drivers:
+                    try:
+                        driver.quit()
+                    except Exception:
+                        pass
+            self.idle = {}
+            self.counts = {}
+
+class ResultCache:
+    """Thread-safe in-memory cache whose entries expire after ttl seconds."""
+    
+    def __init__(self, ttl=900):
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self.entries[key]
+                return None
+            return entry[1]
+    
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+
+class CrawlRequestHandler(BaseHTTPRequestHandler):
+    """HTTP API of the crawl daemon.
+
+    GET /product?url=...&zipcode=...          scrape a single product page
+    GET /category?name=...&zipcode=...&max=N  crawl a category
+    GET /health                               pool and cache status
+    """
+    
+    # Set by serve()
+    pool = None
+    cache = None
+    selector_stats = None
+    default_zipcode = "94107"
+    max_attempts = 3
+    category_map = None
+    
+    def do_GET(self):
+        parsed = urllib.parse.urlparse(self.path)
+        params = {key: values[0] for key, values in urllib.parse.parse_qs(parsed.query).items()}
+        zipcode = params.get("zipcode", self.default_zipcode)
+        try:
+            if parsed.path == "/health":
+                with self.pool.condition:
+                    idle = {z: len(drivers) for z, drivers in self.pool.idle.items()}
+                self._send_json(200, {"status": "ok", "idle_browsers": idle, "cached_results": len(self.cache.entries)})
+            elif parsed.path == "/product":
+                if "url" not in params:
+                    self._send_json(400, {"error": "missing url parameter"})
+                    return
+                url = absolute_product_url(params["url"])
+                if not is_costco_product_url(url):
+                    # The pooled browsers are only for Costco product pages
+                    self._send_json(400, {"error": f"not a Costco product URL: {url}"})
+                    return
+                self._send_cached(("product", zipcode, url), zipcode,
+                                  lambda driver: scrape_product_page(driver, products_from_urls([url])[0], 1, self.selector_stats))
+            elif parsed.path == "/category":
+                category = params.get("name", "produce")
+                try:
+                    max_items = int(params.get("max", 0))
+                except ValueError:
+                    max_items = -1
+                if max_items < 0:
+                    self._send_json(400, {"error": f"max must be a whole number of at least 0, not {params['max']!r}"})
+                    return
+                self._send_cached(("category", zipcode, category.lower(), max_items), zipcode,
+                                  lambda driver: scrape_items(driver, category=category, max_items=max_items,
+                                                              max_attempts=self.max_attempts,
+                                                              selector_stats=self.selector_stats,
+                                                              category_map=self.category_map))
+            else:
+                self._send_json(404, {"error": f"unknown endpoint: {parsed.path}"})
+        except CategoryUrlError as e:
+            self._send_json(404, {"error": str(e)})
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+    
+    def _send_cached(self, key, zipcode, crawl):
+        """Answer from the cache, or run the crawl on a pooled browser and cache the result."""
+        result = self.cache.get(key)
+        if result is not None:
+            self._send_json(200, {"cached": True, "result": result})
+            return
+        
+        driver = self.pool.acquire(zipcode)
+        try:
+            result = crawl(driver)
+        except CategoryUrlError:
+            # Only the category was wrong, the browser is fine
+            self.pool.release(zipcode, driver)
+            raise
+        except Exception:
+            # The browser may be in a bad state, so don't hand it out again
+            self.pool.discard(zipcode, driver)
+            raise
+        self.pool.release(zipcode, driver)
+        self.cache.put(key, result)
+        self._send_json(200, {"cached": False, "result": result})
+    
+    def _send_json(self, status, body):
+        data = json.dumps(body, default=record_to_json).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+def serve(host="127.0.0.1", port=8765, zipcodes=("94107",), headless=True, pool_size=1,
+          cache_ttl=900, max_attempts=3, selector_stats=None, browser_cache=None, category_map=None):
+    """Run the crawl daemon: warm browsers per zip code behind a local HTTP API."""
+    pool = BrowserPool(headless=headless, size_per_zipcode=pool_size, browser_cache=browser_cache)
+    logger.info("Warming %s browser(s) for zipcodes: %s", pool_size, ', '.join(zipcodes))
+    pool.warm(zipcodes)
+    
+    CrawlRequestHandler.pool = pool
+    CrawlRequestHandler.cache = ResultCache(ttl=cache_ttl)
+    CrawlRequestHandler.selector_stats = selector_stats
+    CrawlRequestHandler.default_zipcode = zipcodes[0]
+    CrawlRequestHandler.max_attempts = max_attempts
+    CrawlRequestHandler.category_map = category_map if category_map is not None else CategoryMap(cache_file=None)
+    
+    server = ThreadingHTTPServer((host, port), CrawlRequestHandler)
+    logger.info("Crawl daemon listening on http://%s:%s", host, port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down crawl daemon")
+    finally:
+        server.server_close()
+        pool.close()
+
+# Scheduler defaults for categories that have not been crawled twice yet
+DEFAULT_CHANGE_RATE = 0.05  # Share of items changing per hour
+DEFAULT_CRAWL_HOURS = 0.25  # Browser time per crawl
+CHANGE_RATE_SMOOTHING = 0.5  # Weight of the newest observation in the running averages
+
+def snapshot_fingerprints(items):
+    """Reduce a crawl to item ID -> checksum of the fields that can change."""
+    return {item['id']: format(zlib.crc32(f"{item['name']}|{item['price']}|{item['image_url']}".encode('utf-8')), '08x')
+            for item in items}
+
+def change_fraction(old, new):
+    """Share of items added, removed or changed between two snapshots."""
+    ids = set(old) | set(new)
+    if not ids:
+        return 0.0
+    return sum(1 for item_id in ids if old.get(item_id) != new.get(item_id)) / len(ids)
+
+def record_crawl(entry, items, started, duration, failed_urls=()):
+    """Update a category's schedule entry with the result of a crawl.
+
+    Items are assumed to change independently at a constant rate, so the
+    share that changed between two crawls hours apart gives the rate as
+    -ln(1 - share) / hours. Rate and crawl time are smoothed over crawls.
+    Products whose pages failed (failed_urls) would look removed, so they
+    are left out of the comparison and keep their last known fingerprint.
+    """
+    fingerprints = snapshot_fingerprints(items)
+    ids_by_url = {item['url']: item['id'] for item in items}
+    old_snapshot = entry.get('snapshot')
+    old_ids_by_url = entry.get('ids_by_url') or {}
+    failed_ids = {old_ids_by_url[url] for url in failed_urls if url in old_ids_by_url}
+    
+    if old_snapshot is not None and entry.get('last_crawl'):
+        hours = max((started - entry['last_crawl']) / 3600, 1e-3)
+        compared = {item_id: fingerprint for item_id, fingerprint in old_snapshot.items() if item_id not in failed_ids}
+        changed = min(change_fraction(compared, fingerprints), 0.99)
+        rate = -math.log(1 - changed) / hours
+        if entry.get('change_rate') is None:
+            entry['change_rate'] = rate
+        else:
+            entry['change_rate'] += CHANGE_RATE_SMOOTHING * (rate - entry['change_rate'])
+        logger.info("%.1f%% of items changed in %.1f hours (rate now %.4f/hour)", changed * 100, hours, entry['change_rate'])
+    crawl_hours = duration / 3600
+    if entry.get('crawl_hours') is None:
+        entry['crawl_hours'] = crawl_hours
     else:
-        # If user specified custom filename, use that
-        filename = args.output
+        entry['crawl_hours'] += CHANGE_RATE_SMOOTHING * (crawl_hours - entry['crawl_hours'])
+    
+    # Compare the failed products with their last known state next time
+    for url in failed_urls:
+        item_id = old_ids_by_url.get(url)
+        if item_id in (old_snapshot or {}) and item_id not in fingerprints:
+            fingerprints[item_id] = old_snapshot[item_id]
+            ids_by_url[url] = item_id
+    entry['snapshot'] = fingerprints
+    entry['ids_by_url'] = ids_by_url
+    entry['items'] = len(fingerprints)
+    entry['last_crawl'] = started
+    entry.pop('retry_after', None)
+
+def freshness_gain(rate, frequency):
+    """Marginal freshness from crawling a little more often.
+
+    A category crawled every 1/frequency hours whose items change at `rate`
+    is on average (frequency / rate) * (1 - exp(-rate / frequency)) fresh;
+    this is its derivative with respect to frequency.
+    """
+    if rate <= 1e-9:
+        return 0.0
+    x = rate / frequency
+    return (1 - math.exp(-x) * (1 + x)) / rate
+
+def plan_intervals(state, categories, budget_hours, min_interval, max_interval):
+    """Assign each category a crawl interval (hours) within a daily browser budget.
+
+    Maximizes the expected share of fresh items (weighted by category size)
+    for budget_hours of browser time per day: every category is crawled
+    until the freshness it gains per browser-hour drops to the same level,
+    found by bisection. Categories that change too fast to keep fresh get
+    the longest interval rather than eating the budget.
+    """
+    min_frequency, max_frequency = 1 / max_interval, 1 / min_interval
+    params = {}
+    for category in categories:
+        entry = state.get(category, {})
+        rate = entry.get('change_rate')
+        params[category] = (
+            DEFAULT_CHANGE_RATE if rate is None else rate,
+            entry.get('crawl_hours') or DEFAULT_CRAWL_HOURS,
+            max(entry.get('items') or 1, 1),
+        )
+    
+    def frequency_at(price, rate, cost, weight):
+        # Highest frequency whose marginal gain per browser-hour is still above price
+        if weight * freshness_gain(rate, max_frequency) >= price * cost:
+            return max_frequency
+        if weight * freshness_gain(rate, min_frequency) <= price * cost:
+            return min_frequency
+        low, high = min_frequency, max_frequency
+        for _ in range(60):
+            mid = (low + high) / 2
+            if weight * freshness_gain(rate, mid) > price * cost:
+                low = mid
+            else:
+                high = mid
+        return low
+    
+    def plan(price):
+        return {category: frequency_at(price, *params[category]) for category in categories}
     
-    print(f"Running with settings: visible={not args.visible}, zipcode={args.zipcode}, category={args.category}, output={filename}, max_items={args.max}")
+    def daily_hours(frequencies):
+        return sum(24 * frequencies[category] * params[category][1] for category in categories)
     
-    driver = setup_driver(headless=not args.visible)
+    frequencies = plan(0.0)
+    if daily_hours(frequencies) > budget_hours:
+        low, high = 0.0, 1.0
+        while daily_hours(plan(high)) > budget_hours and high < 1e12:
+            high *= 10
+        for _ in range(60):
+            mid = (low + high) / 2
+            if daily_hours(plan(mid)) > budget_hours:
+                low = mid
+            else:
+                high = mid
+        frequencies = plan(high)
+    return {category: 1 / frequency for category, frequency in frequencies.items()}
+
+def load_schedule_state(filename):
+    """Load the per-category crawl history of the scheduler (empty if missing)."""
+    if not os.path.exists(filename):
+        return {}
     try:
-        # Take screenshot of the initial state
-        driver.get("https://sameday.costco.com")
-        time.sleep(3)
-        driver.save_screenshot("before_location.png")
-        print("Took screenshot of initial state")
+        with open(filename, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read schedule state from %s, starting fresh: %s", filename, e)
+        return {}
+
+def save_schedule_state(state, filename):
+    """Save the per-category crawl history of the scheduler."""
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+
+def run_scheduler(categories, state, state_file, zipcode, headless=True, budget_hours=2.0,
+                  min_interval=1.0, max_interval=168.0, max_attempts=3, selector_stats=None,
+                  category_map=None, once=False, browser_cache=None):
+    """Crawl categories again and again, each at the interval its change rate earns it.
+
+    Intervals are re-planned after every crawl. Categories never crawled are
+    due at once; otherwise the most overdue category goes first. A failed
+    crawl is tried again after a full interval (retry_after), without
+    counting as a crawl. With once=True, returns when nothing is due instead
+    of waiting.
+    """
+    watchdog = None
+    try:
+        while True:
+            intervals = plan_intervals(state, categories, budget_hours, min_interval, max_interval)
+            now = time.time()
+            next_due = {category: max(state.get(category, {}).get('last_crawl', 0) + intervals[category] * 3600,
+                                      state.get(category, {}).get('retry_after', 0))
+                        for category in categories}
+            category = min(categories, key=lambda c: next_due[c])
+            if next_due[category] > now:
+                if once:
+                    logger.info("No categories due, exiting.")
+                    return
+                wait = next_due[category] - now
+                logger.info("Next crawl: %s in %.1f hours", category, wait / 3600)
+                time.sleep(min(wait, 3600))
+                continue
+            
+            if watchdog is None:
+                session_factory = lambda: start_session(headless=headless, zipcode=zipcode, browser_cache=browser_cache)
+                driver = session_factory()
+                if driver is None:
+                    logger.error("Failed to set location. Exiting.")
+                    return
+                watchdog = DriverWatchdog(driver, session_factory)
+            
+            logger.info("Crawling %s (interval %.1f hours)", category, intervals[category])
+            entry = state.setdefault(category, {})
+            failures = []
+            started = time.time()
+            try:
+                items = scrape_items(watchdog.driver, category=category, max_attempts=max_attempts,
+                                     failures=failures, selector_stats=selector_stats,
+                                     category_map=category_map, watchdog=watchdog)
+            except Exception as e:
+                # Wait a full interval before trying this category again, but keep the last
+                # successful crawl as the base of the next change-rate measurement
+                logger.error("Crawl of %s failed: %s", category, e)
+                entry['retry_after'] = started + intervals[category] * 3600
+                save_schedule_state(state, state_file)
+                # The browser may have died with the crawl, so the next one starts a fresh one
+                try:
+                    watchdog.driver.quit()
+                except Exception:
+                    pass
+                watchdog = None
+                continue
+            
+            filename = output_filename(category, zipcode)
+            if items:
+                save_to_csv(items, category=category, filename=filename)
+            if failures:
+                save_failures_to_csv(failures, filename=f"{os.path.splitext(filename)[0]}_failures.csv")
+            record_crawl(entry, items, started, time.time() - started,
+                         failed_urls=[failure['url'] for failure in failures])
+            save_schedule_state(state, state_file)
+    finally:
+        if watchdog is not None:
+            watchdog.driver.quit()
+
+# costco_<category>_items_<zipcode>_<YYYY-MM-DD>.csv, as written by crawl and export
+OUTPUT_FILENAME_PATTERN = re.compile(r"^costco_(?P<category>.+)_items_(?P<zipcode>[^_]+)_(?P<date>\d{4}-\d{2}-\d{2})\.csv$")
+
+def parse_price(text):
+    """Return the dollar amount in a price text like "Current price: $5.99" (None if there is none)."""
+    match = re.search(r"\$\s*([\d,]+(?:\.\d+)?)", text or "")
+    return float(match.group(1).replace(",", "")) if match else None
+
+class HistoryIndex:
+    """SQLite index of every crawl CSV, for item histories and category snapshots.
+
+    Each CSV row becomes one row per (item, zip code, category, date), indexed
+    so that the history of an item or the snapshot of a category is a single
+    index lookup. Files are remembered by path, size and modification time,
+    so ingesting a directory again only reads new or changed files.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS snapshots (
+                item_id TEXT NOT NULL,
+                zipcode TEXT NOT NULL,
+                category TEXT NOT NULL,
+                crawl_date TEXT NOT NULL,
+                name TEXT,
+                price TEXT,
+                price_value REAL,
+                url TEXT,
+                image_url TEXT,
+                source_file TEXT NOT NULL,
+                PRIMARY KEY (item_id, zipcode, category, crawl_date)
+            );
+            CREATE INDEX IF NOT EXISTS snapshots_by_category
+                ON snapshots (category, zipcode, crawl_date);
+            CREATE INDEX IF NOT EXISTS snapshots_by_source ON snapshots (source_file);
+            CREATE TABLE IF NOT EXISTS ingested_files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                rows INTEGER NOT NULL,
+                ingested_at REAL NOT NULL
+            );""")
+    
+    def ingest(self, filename, category=None, zipcode=None, crawl_date=None):
+        """Add one crawl CSV to the index; returns the number of rows added (0 if unchanged).
+
+        Category, zip code and date are read from the standard output file
+        name unless given.
+        """
+        path = os.path.abspath(filename)
+        match = OUTPUT_FILENAME_PATTERN.match(os.path.basename(filename))
+        category = category or (match and match.group("category"))
+        zipcode = zipcode or (match and match.group("zipcode"))
+        crawl_date = crawl_date or (match and match.group("date"))
+        if not (category and zipcode and crawl_date):
+            raise ValueError(f"Can't tell category, zip code and date of {filename}; pass them explicitly")
         
-        # Handle any initial popups before setting location
-        handle_popups(driver)
+        stat = os.stat(path)
+        known = self.conn.execute("SELECT size, mtime FROM ingested_files WHERE path = ?", (path,)).fetchone()
+        if known is not None and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+            return 0
         
-        if not set_location(driver, zipcode=args.zipcode):
-            print("Failed to set location. Exiting.")
+        with open(path, 'r', newline='', encoding='utf-8') as csvfile:
+            rows = [(row['id'], zipcode, category, crawl_date, row['name'], row['price'], parse_price(row['price']),
+                     row['url'], row['image_url'], path)
+                    for row in csv.DictReader(csvfile) if row.get('id')]
+        with self.conn:
+            # A changed file replaces everything it contributed before
+            self.conn.execute("DELETE FROM snapshots WHERE source_file = ?", (path,))
+            self.conn.executemany("INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.execute("INSERT OR REPLACE INTO ingested_files VALUES (?, ?, ?, ?, ?)",
+                              (path, stat.st_size, stat.st_mtime, len(rows), time.time()))
+        return len(rows)
+    
+    def item_history(self, item_id, zipcode=None):
+        """Return every snapshot of an item (optionally in one zip code), oldest first."""
+        query = "SELECT * FROM snapshots WHERE item_id = ?"
+        params = [item_id]
+        if zipcode:
+            query += " AND zipcode = ?"
+            params.append(zipcode)
+        return self.conn.execute(query + " ORDER BY crawl_date, zipcode", params).fetchall()
+    
+    def category_snapshot(self, category, zipcode, crawl_date=None):
+        """Return a category's items in a zip code on a date (default: the latest crawl)."""
+        if crawl_date is None:
+            row = self.conn.execute("SELECT MAX(crawl_date) FROM snapshots WHERE category = ? AND zipcode = ?",
+                                    (category, zipcode)).fetchone()
+            crawl_date = row[0]
+        return self.conn.execute(
+            "SELECT * FROM snapshots WHERE category = ? AND zipcode = ? AND crawl_date = ? ORDER BY name",
+            (category, zipcode, crawl_date)).fetchall()
+    
+    def close(self):
+        self.conn.close()
+
+def print_run_summary(summary):
+    """Print the end-of-run summary of a crawl."""
+    logger.info("Run summary:")
+    logger.info("  Items saved: %s", summary['items'])
+    logger.info("  Failed product pages: %s", summary['failed_pages'])
+    if summary.get('skipped_pages'):
+        logger.info("  Skipped product pages (time budget): %s", summary['skipped_pages'])
+    hedges = summary.get('hedges')
+    if hedges:
+        logger.info("  Hedged page loads: %s (%s won by the spare browser, %ss of tail latency saved, deadline %ss)",
+                    hedges['hedged'], hedges['won'], hedges['saved_seconds'], hedges['deadline_seconds'])
+    recycles = summary.get('driver_recycles', [])
+    logger.info("  Browser recycles: %s", len(recycles))
+    for event in recycles:
+        status = "" if event['succeeded'] else " (failed, kept old browser)"
+        logger.info("    %s after %s pages: %s%s", event['time'], event['pages'], event['reason'], status)
+
+def open_browser_cache(args):
+    """Return the shared browser cache selected on the command line (None if disabled)."""
+    if not args.browser_cache or args.browser_cache_mb <= 0:
+        return None
+    return BrowserCache(args.browser_cache, max_mb=args.browser_cache_mb)
+
+def split_list(value):
+    """Split a comma-separated command-line value into a list."""
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+def output_filename(category, zipcode, output=None):
+    """Generate the output filename with category, zipcode and date (unless one is given)."""
+    if output is not None:
+        # If user specified custom filename, use that
+        return output
+    today_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    return f"costco_{category}_items_{zipcode}_{today_date}.csv"
+
+def command_crawl(args):
+    """Crawl one category on the live site and save it to CSV."""
+    started = time.time()
+    if args.discovery == 'sitemap':
+        # The sitemap doesn't say which category a product is in, so don't label the output with one
+        if args.category is not None:
+            logger.error("--category can't be used with --discovery sitemap (use --url-filter to narrow the sitemap down). Exiting.")
+            return
+        args.category = 'sitemap'
+    elif args.category is None:
+        args.category = 'produce'
+    filename = output_filename(args.category, args.zipcode, args.output)
+    failures_filename = f"{os.path.splitext(filename)[0]}_failures.csv"
+    
+    # With a time budget, stop in time to save what was crawled so far
+    deadline = None
+    previous_prices = None
+    if args.time_budget:
+        deadline = started + args.time_budget * 60 - TIME_BUDGET_RESERVE
+        previous_output = find_previous_output(args.category, args.zipcode, exclude=filename)
+        previous_prices = load_previous_prices(previous_output)
+        logger.info("Time budget: %s minutes, comparing with %s", args.time_budget, previous_output or 'no previous crawl')
+    
+    logger.info("Running with settings: visible=%s, zipcode=%s, category=%s, output=%s, max_items=%s", args.visible, args.zipcode, args.category, filename, args.max)
+    
+    # Enumerate product URLs up front when not scrolling the category page
+    product_urls = None
+    if args.discovery == 'sitemap':
+        product_urls = discover_sitemap_products(args.sitemap_url, cache_file=args.sitemap_cache,
+                                                 ttl_hours=args.sitemap_ttl, url_filter=args.url_filter)
+        if not product_urls:
+            logger.error("No product URLs found in sitemap. Exiting.")
             return
+    
+    tracer = CommandTracer() if args.trace else None
+    browser_cache = open_browser_cache(args)
+    driver = start_session(headless=not args.visible, zipcode=args.zipcode, tracer=tracer, browser_cache=browser_cache)
+    if driver is None:
+        logger.error("Failed to set location. Exiting.")
+        if tracer is not None:
+            tracer.save(args.trace)
+        return
+    
+    # Retries and browser recycling start fresh, already located browsers
+    session_factory = lambda: start_session(headless=not args.visible, zipcode=args.zipcode, tracer=tracer,
+                                            browser_cache=browser_cache)
+    driver_factory = session_factory if args.retry_fresh_driver else None
+    watchdog = DriverWatchdog(driver, session_factory, max_pages=args.recycle_pages,
+                              max_rss_mb=args.recycle_memory, deadline=deadline)
+    hedger = PageHedger(session_factory, k=args.hedge_factor) if args.hedge_factor > 0 else None
+    
+    failures = []
+    skipped = []
+    selector_stats = load_selector_stats(args.selector_stats)
+    archive = PageArchive(args.record, mode="record") if args.record else None
+    category_map = CategoryMap(args.category_cache, ttl_hours=args.category_ttl)
+    try:
+        items = scrape_items(driver, category=None if product_urls is not None else args.category,
+                             max_items=args.max, max_attempts=args.retries, driver_factory=driver_factory,
+                             failures=failures, selector_stats=selector_stats,
+                             product_urls=product_urls, archive=archive, watchdog=watchdog,
+                             category_map=category_map, paginate=args.discovery == 'pages',
+                             page_tabs=args.page_tabs, deadline=deadline,
+                             previous_prices=previous_prices, skipped=skipped,
+                             parse_workers=args.parse_workers, hedger=hedger)
+        if items:
+            save_to_csv(items, category=args.category, filename=filename)
+        else:
+            logger.info("No items found to save.")
         
-        # Handle any popups after setting location
-        handle_popups(driver)
+        # Report pages that failed every attempt (or were never reached) so they can be filled in later
+        if failures or skipped:
+            save_failures_to_csv(failures + skipped, filename=failures_filename)
+        
+        if deadline is not None:
+            out_of_time = bool(skipped) or any("no time left" in f['error'] for f in failures)
+            write_crawl_status(filename, complete=not out_of_time, items=len(items),
+                               failed_pages=len(failures), skipped_pages=len(skipped),
+                               reason="time budget exhausted" if out_of_time else None)
+        
+        if items and args.history:
+            reason = history_skip_reason(filename, zipcode=args.zipcode)
+            if reason:
+                logger.info("Not adding the crawl to the history index: %s", reason)
+            else:
+                history = HistoryIndex(args.history)
+                try:
+                    history.ingest(filename, category=args.category, zipcode=args.zipcode,
+                                   crawl_date=datetime.date.today().isoformat())
+                    logger.info("Added the crawl to the history index %s", args.history)
+                finally:
+                    history.close()
         
-        items = scrape_items(driver, category=args.category, max_items=args.max)
+        print_run_summary({
+            "items": len(items),
+            "failed_pages": len(failures),
+            "skipped_pages": len(skipped),
+            "driver_recycles": watchdog.events,
+            "hedges": hedger.summary() if hedger is not None else None
+        })
+    
+    finally:
+        # The watchdog may have replaced the original browser
+        watchdog.driver.quit()
+        if hedger is not None:
+            hedger.close()
+        if archive is not None:
+            archive.close()
+        if tracer is not None:
+            tracer.save(args.trace)
+        save_selector_stats(selector_stats, args.selector_stats)
+
+def command_replay(args):
+    """Run the extraction on the pages of a recorded archive, offline."""
+    filename = output_filename(args.category, "replay", args.output)
+    archive = PageArchive(args.archive, mode="replay")
+    selector_stats = load_selector_stats(args.selector_stats)
+    category_map = CategoryMap(args.category_cache, ttl_hours=args.category_ttl)
+    driver = None
+    try:
+        # Product pages are parsed offline, so only a recorded listing page needs a browser
+        _, product_urls = recorded_category(archive, args.category, category_map)
+        if product_urls is None:
+            driver = start_replay_session(headless=not args.visible)
+        # A page missing from the archive won't appear on a retry, so don't retry
+        items = scrape_items(driver, category=args.category, max_items=args.max, max_attempts=1,
+                             selector_stats=selector_stats, archive=archive, category_map=category_map,
+                             parse_workers=args.parse_workers)
         if items:
             save_to_csv(items, category=args.category, filename=filename)
         else:
-            print("No items found to save.")
+            logger.info("No items found to save.")
+    except CategoryUrlError as e:
+        logger.error("%s. Exiting.", e)
+    finally:
+        if driver is not None:
+            driver.quit()
+        archive.close()
+        # The stats are only read: hits and misses on old recorded pages must not reorder the selectors of live crawls
+
+def command_serve(args):
+    """Keep located browsers warm and answer crawl requests over HTTP."""
+    selector_stats = load_selector_stats(args.selector_stats)
+    try:
+        serve(host=args.host, port=args.port, zipcodes=split_list(args.zipcode),
+              headless=not args.visible, pool_size=args.pool_size, cache_ttl=args.cache_ttl,
+              max_attempts=args.retries, selector_stats=selector_stats,
+              browser_cache=open_browser_cache(args),
+              category_map=CategoryMap(args.category_cache, ttl_hours=args.category_ttl))
+    finally:
+        save_selector_stats(selector_stats, args.selector_stats)
+
+def command_enqueue(args):
+    """Add every category and zip code combination to the work queue."""
+    enqueue_crawl(open_work_queue(args.queue), args.job, split_list(args.category),
+                  split_list(args.zipcode), max_items=args.max)
+
+def command_worker(args):
+    """Run tasks from the work queue until the job is finished."""
+    selector_stats = load_selector_stats(args.selector_stats)
+    try:
+        run_worker(open_work_queue(args.queue), job=args.job, headless=not args.visible,
+                   max_attempts=args.retries, lease_seconds=args.lease_seconds,
+                   selector_stats=selector_stats, browser_cache=open_browser_cache(args),
+                   category_map=CategoryMap(args.category_cache, ttl_hours=args.category_ttl))
+    finally:
+        save_selector_stats(selector_stats, args.selector_stats)
+
+def command_schedule(args):
+    """Keep categories fresh by crawling each at an interval matching its change rate."""
+    category_map = CategoryMap(args.category_cache, ttl_hours=args.category_ttl)
+    categories = split_list(args.category) if args.category else list(category_map.categories)
+    state = load_schedule_state(args.state)
+    
+    intervals = plan_intervals(state, categories, args.budget, args.min_interval, args.max_interval)
+    logger.info("Planned crawl intervals for %s browser-hours per day:", args.budget)
+    for category in sorted(categories, key=lambda c: intervals[c]):
+        logger.info("  %s: every %.1f hours", category, intervals[category])
     
+    selector_stats = load_selector_stats(args.selector_stats)
+    try:
+        run_scheduler(categories, state, args.state, args.zipcode, headless=not args.visible,
+                      budget_hours=args.budget, min_interval=args.min_interval,
+                      max_interval=args.max_interval, max_attempts=args.retries,
+                      selector_stats=selector_stats, category_map=category_map, once=args.once,
+                      browser_cache=open_browser_cache(args))
     finally:
-        driver.quit()
+        save_selector_stats(selector_stats, args.selector_stats)
+
+def command_export(args):
+    """Write the finished items of a queued job to CSV files."""
+    export_queue_results(open_work_queue(args.queue), job=args.job)
+
+def history_skip_reason(filename, zipcode=None):
+    """Return why a crawl CSV must stay out of the history index, or None if it can go in.
+
+    Replayed archives (zip code "replay" in the name, unless a zip code is
+    given) aren't live crawls, and crawls whose <output>_status.json says
+    they are incomplete would look like a full category snapshot.
+    """
+    match = OUTPUT_FILENAME_PATTERN.match(os.path.basename(filename))
+    if zipcode is None and match and match.group("zipcode") == "replay":
+        return "replayed from an archive, not a live crawl"
+    status_filename = f"{os.path.splitext(filename)[0]}_status.json"
+    if os.path.exists(status_filename):
+        try:
+            with open(status_filename, 'r', encoding='utf-8') as f:
+                status = json.load(f)
+        except (OSError, ValueError) as e:
+            return f"unreadable crawl status {status_filename}: {e}"
+        if not status.get("complete", True):
+            return f"incomplete crawl ({status.get('reason') or 'see ' + status_filename})"
+    return None
+
+def command_history_ingest(args):
+    """Add crawl CSVs to the history index."""
+    filenames = []
+    for pattern in args.files or ["costco_*_items_*.csv"]:
+        filenames.extend(sorted(glob.glob(pattern)) or [pattern])
+    history = HistoryIndex(args.history)
+    try:
+        added = 0
+        for filename in filenames:
+            if filename.endswith("_failures.csv") or not os.path.exists(filename):
+                continue
+            reason = history_skip_reason(filename, zipcode=args.zipcode)
+            if reason:
+                logger.info("Skipping %s: %s", filename, reason)
+                continue
+            try:
+                rows = history.ingest(filename, category=args.category, zipcode=args.zipcode, crawl_date=args.date)
+            except (ValueError, KeyError, csv.Error) as e:
+                logger.warning("Skipping %s: %s", filename, e)
+                continue
+            if rows:
+                logger.info("Ingested %s items from %s", rows, filename)
+            added += rows
+        logger.info("Added %s items to %s", added, args.history)
+    finally:
+        history.close()
+
+def command_history_item(args):
+    """Print the price history of an item."""
+    history = HistoryIndex(args.history)
+    try:
+        for row in history.item_history(args.item_id, zipcode=args.zipcode):
+            print(f"{row['crawl_date']}\t{row['zipcode']}\t{row['category']}\t{row['price']}\t{row['name']}")
+    finally:
+        history.close()
+
+def command_history_category(args):
+    """Print the items of a category as crawled on one date."""
+    history = HistoryIndex(args.history)
+    try:
+        for row in history.category_snapshot(args.category, args.zipcode, crawl_date=args.date):
+            print(f"{row['item_id']}\t{row['price']}\t{row['name']}")
+    finally:
+        history.close()
+
+def command_categories(args):
+    """List the categories that can be crawled (optionally rediscovering them first)."""
+    category_map = CategoryMap(args.category_cache, ttl_hours=args.category_ttl)
+    if args.discover:
+        driver = start_session(headless=not args.visible, zipcode=args.zipcode)
+        if driver is None:
+            logger.error("Failed to set location. Exiting.")
+            return
+        try:
+            category_map.refresh(driver)
+        finally:
+            driver.quit()
+    for category, info in category_map.categories.items():
+        print(f"{category}\t{info['url']}")
+
+def build_parser():
+    """Build the command-line parser with one sub-command per mode."""
+    parser = argparse.ArgumentParser(description='Costco Sameday Crawler')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    
+    # Options shared by the commands that start a browser
+    browser_options = argparse.ArgumentParser(add_help=False)
+    browser_options.add_argument('--visible', action='store_true', help='Run in visible mode (not headless)')
+    browser_options.add_argument('--selector-stats', type=str, default='selector_stats.json', help='File used to persist selector hit statistics across runs')
+    browser_options.add_argument('--browser-cache', type=str, default='browser_cache', help='Directory of the HTTP cache shared by all browsers and runs')
+    browser_options.add_argument('--browser-cache-mb', type=int, default=300, help='Size limit of the shared browser cache in MB (0 = no shared cache)')
+    
+    # Logging options accepted by every command
+    log_options = argparse.ArgumentParser(add_help=False)
+    log_options.add_argument('--log-level', type=str, default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Minimum level of log messages to show')
+    log_options.add_argument('--log-format', choices=['text', 'json'], default='text', help='Write log messages as plain text or one JSON object per line')
+    log_options.add_argument('--log-file', type=str, default=None, help='Write log messages to this file instead of stdout')
+    log_options.add_argument('--log-sample', type=int, default=10, help='After the first few, only log every Nth repetitive per-product message (1 = log everything)')
+    
+    category_options = argparse.ArgumentParser(add_help=False)
+    category_options.add_argument('--category-cache', type=str, default='category_cache.json', help='File used to cache the categories discovered on the site')
+    category_options.add_argument('--category-ttl', type=float, default=168, help='Hours before an unknown category makes the crawler look for new categories on the site')
+    
+    queue_options = argparse.ArgumentParser(add_help=False)
+    queue_options.add_argument('--queue', type=str, required=True, help='Shared work queue (SQLite file) for crawling one job with several workers')
+    queue_options.add_argument('--job', type=str, default='default', help='Name of the job in the work queue')
+    
+    crawl = subparsers.add_parser('crawl', parents=[browser_options, category_options, log_options], help='Crawl a category (default command)')
+    crawl.add_argument('--zipcode', type=str, default='94107', help='ZIP code for delivery location')
+    crawl.add_argument('--output', type=str, default=None, help='Output CSV filename')
+    crawl.add_argument('--max', type=int, default=0, help='Maximum number of items to crawl (for testing, 0 = no limit)')
+    crawl.add_argument('--category', type=str, default=None, help='Category to crawl (e.g., produce, bakery; default: produce, not allowed with --discovery sitemap)')
+    crawl.add_argument('--retries', type=int, default=3, help='Maximum attempts per product page before it is reported as failed')
+    crawl.add_argument('--retry-fresh-driver', action='store_true', help='Retry failed product pages on a fresh browser session')
+    crawl.add_argument('--discovery', choices=['scroll', 'pages', 'sitemap'], default='scroll', help='How to find product URLs: scroll the category page, fetch its numbered pages in parallel (falls back to scrolling), or read the sitemap')
+    crawl.add_argument('--page-tabs', type=int, default=4, help='Listing pages loaded at the same time with --discovery pages')
+    crawl.add_argument('--sitemap-url', type=str, default='https://sameday.costco.com/sitemap.xml', help='Sitemap URL or local file used with --discovery sitemap')
+    crawl.add_argument('--sitemap-cache', type=str, default='sitemap_cache.json', help='File used to cache sitemap product URLs')
+    crawl.add_argument('--sitemap-ttl', type=float, default=24, help='Hours before the cached sitemap is refreshed')
+    crawl.add_argument('--url-filter', type=str, default=None, help='Only crawl sitemap product URLs containing this text')
+    crawl.add_argument('--recycle-pages', type=int, default=500, help='Restart the browser after this many product pages (0 = never)')
+    crawl.add_argument('--recycle-memory', type=int, default=2048, help='Restart the browser when it uses more than this many MB (0 = never)')
+    crawl.add_argument('--record', type=str, default=None, help='Store every fetched page in this archive file')
+    crawl.add_argument('--parse-workers', type=int, default=0, help='Parse product pages in this many processes while the browser loads the next ones (0 = parse in the browser)')
+    crawl.add_argument('--hedge-factor', type=float, default=0, help='Re-open a product page on a spare browser when its load takes longer than this many times the p95 load time (0 = never)')
+    crawl.add_argument('--time-budget', type=float, default=0, help='Minutes the whole crawl may take; visits new and changed products first and saves in time (0 = no limit)')
+    crawl.add_argument('--history', type=str, default=None, help='Also add the saved CSV to this history index (see the history command)')
+    crawl.add_argument('--trace', type=str, default=None, help='Write a timeline of every WebDriver command to this file (Chrome trace-event JSON)')
+    crawl.set_defaults(handler=command_crawl)
+    
+    replay = subparsers.add_parser('replay', parents=[browser_options, category_options, log_options], help='Re-run extraction on a recorded page archive, offline')
+    replay.add_argument('archive', type=str, help='Archive file written by crawl --record')
+    replay.add_argument('--category', type=str, default='produce', help='Category that was recorded (sitemap for crawls with --discovery sitemap)')
+    replay.add_argument('--output', type=str, default=None, help='Output CSV filename')
+    replay.add_argument('--max', type=int, default=0, help='Maximum number of items to extract (0 = no limit)')
+    replay.add_argument('--parse-workers', type=int, default=0, help='Parse the recorded product pages in this many processes (0 = parse them in this process)')
+    replay.set_defaults(handler=command_replay)
+    
+    daemon = subparsers.add_parser('serve', parents=[browser_options, category_options, log_options], help='Run a daemon with warm browsers behind a local HTTP API')
+    daemon.add_argument('--zipcode', type=str, default='94107', help='ZIP codes to keep browsers warm for (comma-separated)')
+    daemon.add_argument('--host', type=str, default='127.0.0.1', help='Address the daemon listens on')
+    daemon.add_argument('--port', type=int, default=8765, help='Port the daemon listens on')
+    daemon.add_argument('--pool-size', type=int, default=1, help='Warm browsers per ZIP code')
+    daemon.add_argument('--cache-ttl', type=int, default=900, help='Seconds the daemon caches crawl results')
+    daemon.add_argument('--retries', type=int, default=3, help='Maximum attempts per product page in category crawls')
+    daemon.set_defaults(handler=command_serve)
+    
+    enqueue = subparsers.add_parser('enqueue', parents=[queue_options, log_options], help='Add a crawl job to the work queue')
+    enqueue.add_argument('--category', type=str, default='produce', help='Categories to crawl (comma-separated)')
+    enqueue.add_argument('--zipcode', type=str, default='94107', help='ZIP codes to crawl (comma-separated)')
+    enqueue.add_argument('--max', type=int, default=0, help='Maximum number of items per category (0 = no limit)')
+    enqueue.set_defaults(handler=command_enqueue)
+    
+    worker = subparsers.add_parser('worker', parents=[queue_options, browser_options, category_options, log_options], help='Run tasks from the work queue')
+    worker.add_argument('--retries', type=int, default=3, help='Maximum attempts per task before it is reported as failed')
+    worker.add_argument('--lease-seconds', type=int, default=900, help='Seconds a worker may hold a task before it is handed to another worker')
+    worker.set_defaults(handler=command_worker)
+    
+    schedule = subparsers.add_parser('schedule', parents=[browser_options, category_options, log_options], help='Crawl categories repeatedly, more often the faster they change')
+    schedule.add_argument('--category', type=str, default=None, help='Categories to keep fresh (comma-separated, default: all)')
+    schedule.add_argument('--zipcode', type=str, default='94107', help='ZIP code for delivery location')
+    schedule.add_argument('--budget', type=float, default=2.0, help='Browser-hours per day to spend on crawling')
+    schedule.add_argument('--min-interval', type=float, default=1.0, help='Never crawl a category more often than every this many hours')
+    schedule.add_argument('--max-interval', type=float, default=168.0, help='Crawl every category at least every this many hours')
+    schedule.add_argument('--retries', type=int, default=3, help='Maximum attempts per product page before it is reported as failed')
+    schedule.add_argument('--state', type=str, default='schedule_state.json', help='File keeping the change rates and last crawl of each category')
+    schedule.add_argument('--once', action='store_true', help='Run the crawls that are due now, then exit (e.g. from cron)')
+    schedule.set_defaults(handler=command_schedule)
+    
+    export = subparsers.add_parser('export', parents=[queue_options, log_options], help='Write the results of a queued job to CSV files')
+    export.set_defaults(handler=command_export)
+    
+    history_options = argparse.ArgumentParser(add_help=False)
+    history_options.add_argument('--history', type=str, default='history.db', help='History index file (SQLite)')
+    history = subparsers.add_parser('history', help='Index crawl CSVs and look up item histories and category snapshots')
+    history_commands = history.add_subparsers(dest='history_command', metavar='history_command', required=True)
+    
+    history_ingest = history_commands.add_parser('ingest', parents=[history_options, log_options], help='Add crawl CSVs to the index (skips files already added)')
+    history_ingest.add_argument('files', nargs='*', help='CSV files or glob patterns (default: costco_*_items_*.csv)')
+    history_ingest.add_argument('--category', type=str, default=None, help='Category of the files, if not in their names')
+    history_ingest.add_argument('--zipcode', type=str, default=None, help='ZIP code of the files, if not in their names')
+    history_ingest.add_argument('--date', type=str, default=None, help='Crawl date (YYYY-MM-DD) of the files, if not in their names')
+    history_ingest.set_defaults(handler=command_history_ingest)
+    
+    history_item = history_commands.add_parser('item', parents=[history_options, log_options], help='Price history of an item')
+    history_item.add_argument('item_id', type=str, help='Costco item number')
+    history_item.add_argument('--zipcode', type=str, default=None, help='Only this ZIP code')
+    history_item.set_defaults(handler=command_history_item)
+    
+    history_category = history_commands.add_parser('category', parents=[history_options, log_options], help='Items of a category on one date')
+    history_category.add_argument('category', type=str, help='Category name')
+    history_category.add_argument('--zipcode', type=str, default='94107', help='ZIP code')
+    history_category.add_argument('--date', type=str, default=None, help='Crawl date (YYYY-MM-DD, default: latest)')
+    history_category.set_defaults(handler=command_history_category)
+    
+    categories = subparsers.add_parser('categories', parents=[category_options, log_options], help='List the categories that can be crawled')
+    categories.add_argument('--visible', action='store_true', help='Run in visible mode (not headless) when discovering')
+    categories.add_argument('--discover', action='store_true', help='Read the categories from the site navigation before listing them')
+    categories.add_argument('--zipcode', type=str, default='94107', help='ZIP code for delivery location when discovering')
+    categories.set_defaults(handler=command_categories)
+    
+    return parser, set(subparsers.choices)
+
+def main(argv=None):
+    parser, commands = build_parser()
+    argv = sys.argv[1:] if argv is None else list(argv)
+    
+    # Without a sub-command, crawl (keeps "costco_crawler.py --category bakery" working)
+    if not argv or (argv[0] not in commands and argv[0] not in ('-h', '--help')):
+        argv = ['crawl'] + argv
+    
+    args = parser.parse_args(argv)
+    listener = setup_logging(args.log_level, args.log_format == 'json', args.log_file, args.log_sample)
+    try:
+        args.handler(args)
+    finally:
+        listener.stop()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,47 @@
+import os
+import subprocess
+import sys
+
+# Cumulative import time of the module, as reported by python -X importtime
+IMPORT_BUDGET_MS = 250
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BROWSER_MODULES = ("selenium", "webdriver_manager")
+
+
+def run_python(*args):
+    return subprocess.run([sys.executable, "-X", "importtime"] + list(args), cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+
+def imported_modules(importtime_output):
+    """Return {module name: cumulative microseconds} from -X importtime output."""
+    modules = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+def test_import_skips_browser_dependencies():
+    result = run_python("-c", "import sys, costco_crawler; print(' '.join(sys.modules))")
+    loaded = {name.split(".")[0] for name in result.stdout.split()}
+    for module in BROWSER_MODULES:
+        assert module not in loaded
+
+
+def test_import_time_budget():
+    # Best of three, so a busy machine doesn't fail the test
+    timings = [imported_modules(run_python("-c", "import costco_crawler").stderr)["costco_crawler"]
+               for _ in range(3)]
+    assert min(timings) / 1000 < IMPORT_BUDGET_MS
+
+
+def test_help_skips_browser_dependencies():
+    result = run_python("costco_crawler.py", "crawl", "--help")
+    assert "--category" in result.stdout
+    modules = imported_modules(result.stderr)
+    for module in BROWSER_MODULES:
+        assert module not in modules
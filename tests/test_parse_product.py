@@ -0,0 +1,86 @@
+import os
+
+import costco_crawler
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+BANANAS = "https://sameday.costco.com/store/costco/products/18156-kirkland-signature-organic-bananas-3-lb"
+EGGS = "https://sameday.costco.com/store/costco/products/17602-kirkland-signature-large-eggs-24-ct"
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def parse(name, page_url):
+    return costco_crawler.parse_product_html(read_fixture(name), page_url, costco_crawler.ID_SELECTORS,
+                                             costco_crawler.DETAIL_IMG_SELECTORS)
+
+
+def test_parses_the_details_the_browser_script_reads():
+    details = parse("product_page.html", BANANAS)
+    assert details == {
+        "item_id": "18156",
+        "id_selector_index": 0,
+        # Resolved against the page URL, like img.src in the browser
+        "hero_src": "https://sameday.costco.com/image-server/150x150/filters:format(webp)/bananas.jpg",
+        "hero_srcset": "https://www.instacart.com/image-server/197x197/bananas.jpg 1x, "
+                       "https://www.instacart.com/image-server/394x394/bananas.jpg 2x, "
+                       "https://www.instacart.com/image-server/591x591/bananas.jpg 3x, "
+                       "https://www.instacart.com/image-server/788x788/bananas.jpg 4x",
+        "img_selector_index": 0,
+        "name": "Kirkland Signature Organic Bananas, 3 lb",
+        "price": "Current price: $2.49",
+    }
+
+
+def test_falls_back_along_the_selector_chains():
+    details = parse("product_page_fallback.html", EGGS)
+    assert details["item_id"] == "17602"
+    assert details["id_selector_index"] == costco_crawler.ID_SELECTORS.index(costco_crawler.ID_FALLBACK_SELECTOR)
+    assert details["hero_src"] == "https://www.instacart.com/image-server/394x394/eggs.jpg"
+    assert details["hero_srcset"] is None
+    assert details["img_selector_index"] == 2
+    assert details["name"] == "Kirkland Signature Large Eggs, 24 ct"
+    assert details["price"] is None
+
+
+def test_completed_product_uses_the_largest_image():
+    product = costco_crawler.products_from_urls([BANANAS])[0]
+    item = costco_crawler.complete_product(product, parse("product_page.html", BANANAS), 1)
+    assert item.to_dict() == {
+        "name": "Kirkland Signature Organic Bananas, 3 lb",
+        "id": "18156",
+        "url": BANANAS,
+        "image_url": "https://www.instacart.com/image-server/788x788/bananas.jpg",
+        "price": "Current price: $2.49",
+    }
+
+
+def record_archive(path):
+    archive = costco_crawler.PageArchive(path, mode="record")
+    archive.category = "sitemap"
+    archive.record(BANANAS, "detail", read_fixture("product_page.html"))
+    archive.record(EGGS, "detail", read_fixture("product_page_fallback.html"))
+    archive.close()
+
+
+def test_replay_parses_the_same_items_with_and_without_workers(tmp_path):
+    path = str(tmp_path / "archive.db")
+    record_archive(path)
+    archive = costco_crawler.PageArchive(path, mode="replay")
+    try:
+        selector_stats = costco_crawler.SelectorStats()
+        # No browser: replayed product pages are parsed offline
+        in_process = costco_crawler.scrape_items(None, category="sitemap", max_attempts=1,
+                                                 selector_stats=selector_stats, archive=archive)
+        in_workers = costco_crawler.scrape_items(None, category="sitemap", max_attempts=1,
+                                                 archive=archive, parse_workers=2)
+    finally:
+        archive.close()
+
+    assert [item.to_dict() for item in in_process] == [item.to_dict() for item in in_workers]
+    assert [item['id'] for item in in_process] == ["18156", "17602"]
+    assert selector_stats["item_id"][costco_crawler.ID_SELECTORS[0]]["hits"] == 1
+    assert selector_stats["item_id"][costco_crawler.ID_FALLBACK_SELECTOR]["hits"] == 1
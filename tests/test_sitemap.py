@@ -0,0 +1,39 @@
+import os
+
+import costco_crawler
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+BANANAS = "https://sameday.costco.com/store/costco/products/18156-kirkland-signature-organic-bananas-3-lb"
+EGGS = "https://sameday.costco.com/store/costco/products/17602-kirkland-signature-large-eggs-24-ct"
+STRAWBERRIES = "https://sameday.costco.com/store/costco/products/19223-strawberries-2-lb"
+PAPER_TOWELS = "https://sameday.costco.com/store/costco/products/30012-kirkland-signature-paper-towels"
+PRODUCE = "https://sameday.costco.com/store/costco/collections/produce"
+
+
+def test_urlset_lists_every_loc_in_order():
+    urls = list(costco_crawler.iter_sitemap_urls(os.path.join(FIXTURES, "sitemap_products.xml")))
+    assert urls == [BANANAS, EGGS, STRAWBERRIES, BANANAS]
+
+
+def test_urlset_without_namespace():
+    urls = list(costco_crawler.iter_sitemap_urls(os.path.join(FIXTURES, "sitemap_pages.xml")))
+    assert urls == [PRODUCE, PAPER_TOWELS]
+
+
+def test_sitemap_index_follows_relative_sitemaps():
+    urls = list(costco_crawler.iter_sitemap_urls(os.path.join(FIXTURES, "sitemap_index.xml")))
+    assert urls == [BANANAS, EGGS, STRAWBERRIES, BANANAS, PRODUCE, PAPER_TOWELS]
+
+
+def test_discovery_keeps_unique_product_urls(tmp_path):
+    cache_file = str(tmp_path / "sitemap_cache.json")
+    sitemap = os.path.join(FIXTURES, "sitemap_index.xml")
+    
+    urls = costco_crawler.discover_sitemap_products(sitemap, cache_file=cache_file)
+    assert urls == [BANANAS, EGGS, STRAWBERRIES, PAPER_TOWELS]
+    
+    # The second call is answered from the cache, with the filter applied to it
+    assert os.path.exists(cache_file)
+    assert costco_crawler.discover_sitemap_products(sitemap, cache_file=cache_file, url_filter="kirkland") == \
+        [BANANAS, EGGS, PAPER_TOWELS]
@@ -0,0 +1,144 @@
+import costco_crawler
+
+JOB = "test-job"
+
+
+def open_queue(tmp_path):
+    return costco_crawler.SQLiteWorkQueue(str(tmp_path / "jobs.db"))
+
+
+def add_detail(work_queue, key="detail:98101:a", job=JOB):
+    work_queue.add_tasks(job, [{"kind": "detail", "key": key, "payload": {"zipcode": "98101"}}])
+
+
+def test_leased_task_is_not_leased_twice(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue)
+    task = work_queue.lease(JOB, "worker-1", lease_seconds=60)
+    assert task['key'] == "detail:98101:a"
+    assert task['attempts'] == 1
+    assert work_queue.lease(JOB, "worker-2", lease_seconds=60) is None
+    assert not work_queue.is_finished(JOB)
+
+
+def test_expired_lease_is_leased_again(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue)
+    # A negative lease is already expired, as if the worker stopped responding
+    first = work_queue.lease(JOB, "worker-1", lease_seconds=-1)
+    second = work_queue.lease(JOB, "worker-2", lease_seconds=60)
+    assert second['id'] == first['id']
+    assert second['attempts'] == 2
+    assert second['lease_token'] != first['lease_token']
+
+
+def test_stale_lease_token_cannot_complete(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue)
+    stale = work_queue.lease(JOB, "worker-1", lease_seconds=-1)
+    current = work_queue.lease(JOB, "worker-2", lease_seconds=60)
+
+    new_tasks = [{"kind": "detail", "key": "detail:98101:b", "payload": {}}]
+    assert not work_queue.complete(stale, {"id": "stale"}, new_tasks)
+    assert work_queue.complete(current, {"id": "current"})
+
+    finished = work_queue.finished_tasks(JOB)
+    assert [task['key'] for task in finished] == ["detail:98101:a"]
+    assert finished[0]['result'] == {"id": "current"}
+
+
+def test_stale_lease_token_cannot_fail(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue)
+    stale = work_queue.lease(JOB, "worker-1", lease_seconds=-1)
+    current = work_queue.lease(JOB, "worker-2", lease_seconds=60)
+
+    work_queue.fail(stale, "too late", max_attempts=1)
+    assert work_queue.finished_tasks(JOB) == []
+    assert work_queue.complete(current, {"id": "current"})
+    assert work_queue.is_finished(JOB)
+
+
+def test_failed_task_is_dead_at_max_attempts(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue)
+    task = work_queue.lease(JOB, "worker-1", lease_seconds=60, max_attempts=2)
+    work_queue.fail(task, "first", max_attempts=2)
+    # The retry is backed off, so nothing can be leased yet
+    assert work_queue.lease(JOB, "worker-1", lease_seconds=60, max_attempts=2) is None
+    assert not work_queue.is_finished(JOB)
+
+    # Skip the backoff
+    work_queue.conn.execute("UPDATE tasks SET available_at = 0")
+    task = work_queue.lease(JOB, "worker-1", lease_seconds=60, max_attempts=2)
+    assert task['attempts'] == 2
+    work_queue.fail(task, "second", max_attempts=2)
+    finished = work_queue.finished_tasks(JOB)
+    assert [(row['status'], row['error']) for row in finished] == [("failed", "second")]
+    assert work_queue.is_finished(JOB)
+
+
+def test_expired_lease_is_dead_at_max_attempts(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue)
+    work_queue.lease(JOB, "worker-1", lease_seconds=-1, max_attempts=2)
+    work_queue.lease(JOB, "worker-2", lease_seconds=-1, max_attempts=2)
+    assert work_queue.lease(JOB, "worker-3", lease_seconds=60, max_attempts=2) is None
+
+    finished = work_queue.finished_tasks(JOB)
+    assert finished[0]['status'] == "failed"
+    assert finished[0]['attempts'] == 2
+    assert "Lease expired" in finished[0]['error']
+    assert work_queue.is_finished(JOB)
+
+
+def test_finished_tasks_belong_to_the_job(tmp_path):
+    work_queue = open_queue(tmp_path)
+    add_detail(work_queue, key="detail:98101:a")
+    add_detail(work_queue, key="detail:98101:b")
+    add_detail(work_queue, key="detail:98101:a", job="other-job")
+    # Adding a task twice keeps the first one
+    add_detail(work_queue, key="detail:98101:a")
+
+    first = work_queue.lease(JOB, "worker-1", lease_seconds=60)
+    assert work_queue.complete(first, {"id": "1"})
+    assert not work_queue.is_finished(JOB)
+    second = work_queue.lease(JOB, "worker-1", lease_seconds=60)
+    assert work_queue.complete(second, {"id": "2"})
+
+    assert [task['key'] for task in work_queue.finished_tasks(JOB)] == ["detail:98101:a", "detail:98101:b"]
+    assert [task['result'] for task in work_queue.finished_tasks(JOB)] == [{"id": "1"}, {"id": "2"}]
+    assert work_queue.finished_tasks("other-job") == []
+    assert work_queue.is_finished(JOB)
+    assert not work_queue.is_finished("other-job")
+
+
+def test_export_writes_deduplicated_items_and_failures(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    work_queue = open_queue(tmp_path)
+    work_queue.add_tasks(JOB, [{
+        "kind": "detail",
+        "key": f"detail:98101:{name}",
+        "payload": {"category": "produce", "zipcode": "98101", "position": position,
+                    "product_info": {"name": name, "url": f"https://sameday.costco.com/store/costco/products/{name}",
+                                     "image_url": None, "price": "$1.99"}}
+    } for position, name in enumerate(["bananas", "bananas-again", "eggs"], 1)])
+    item_ids = {"bananas": "18156", "bananas-again": "18156"}
+    while True:
+        task = work_queue.lease(JOB, "worker-1", lease_seconds=60)
+        if task is None:
+            break
+        product_info = task['payload']['product_info']
+        if product_info['name'] in item_ids:
+            work_queue.complete(task, dict(product_info, id=item_ids[product_info['name']]))
+        else:
+            work_queue.fail(task, "No item ID", max_attempts=1)
+
+    costco_crawler.export_queue_results(work_queue, JOB)
+    items_file, failures_file = sorted(tmp_path.glob("costco_produce_items_98101_*.csv"))
+    assert items_file.read_text().splitlines() == [
+        "name,id,url,image_url,price",
+        "bananas,18156,https://sameday.costco.com/store/costco/products/bananas,,$1.99"]
+    assert failures_file.name.endswith("_failures.csv")
+    assert failures_file.read_text().splitlines()[1] == \
+        "produce,eggs,https://sameday.costco.com/store/costco/products/eggs,3,1,No item ID"